@@ -0,0 +1,254 @@
+from collections import Counter
+from functools import cached_property
+
+import discord
+import numpy as np
+
+from . import heatmap
+from .graph import InteractionGraph
+from .store import DAY
+from .store import HOUR
+from .store import MESSAGE
+from .words import WordCounter
+
+
+class Tally(Counter):
+    """Counter with the add() method and total of ApproximateCounter."""
+
+    def add(self, item, count=1):
+        self[item] += count
+
+    @property
+    def total(self):
+        """Sum of all counts, like ApproximateCounter.total."""
+        return sum(self.values())
+
+
+class IndexSource:
+    """Answers from the message index for one window, shared by aggregators.
+
+    Each query runs at most once however many aggregators use it. Rows are
+    filtered to the channels and authors of the pass.
+    """
+
+    def __init__(self, store, after, channel_ids=None, author_ids=None):
+        self.store = store
+        self.after = after
+        self.channel_ids = channel_ids
+        self.author_ids = author_ids
+
+    def keep(self, channel_id, author_id):
+        if self.channel_ids is not None and channel_id not in self.channel_ids:
+            return False
+        if self.author_ids is not None and author_id not in self.author_ids:
+            return False
+        return True
+
+    @cached_property
+    def counts(self):
+        """List of (channel_id, author_id, messages, chars)."""
+        return [
+            (channel_id, author_id, messages, chars)
+            for channel_id, author_id, messages, chars, _
+            in self.store.sum_window('channel_id, author_id', self.after)
+            if self.keep(channel_id, author_id)
+        ]
+
+    @cached_property
+    def last_seen(self):
+        """List of (channel_id, author_id, last message datetime)."""
+        return [row for row in self.store.channel_last_seen(self.after) if self.keep(row[0], row[1])]
+
+    @cached_property
+    def interactions(self):
+        """List of (kind, author_id, target_id, count)."""
+        channel_ids = list(self.channel_ids) if self.channel_ids is not None else None
+        return [
+            row for row in self.store.interactions(self.after, channel_ids=channel_ids)
+            if self.author_ids is None or row[1] in self.author_ids
+        ]
+
+    @cached_property
+    def hourly_counts(self):
+        """List of (hour, messages)."""
+        return [
+            (hour, messages)
+            for hour, channel_id, author_id, messages in self.store.hourly_counts(self.after)
+            if self.keep(channel_id, author_id)
+        ]
+
+
+class Aggregator:
+    """Statistic computed in one pass over messages.
+
+    add(message) is called for every message that passes the filters of the
+    pass. Aggregators which set `indexed` can read the same statistic from
+    an IndexSource instead, in add_index(source), as long as the index keeps
+    rows of `resolution` for the window.
+    """
+
+    indexed = False
+    resolution = DAY
+
+    def add(self, message: discord.Message):
+        raise NotImplementedError
+
+    def add_index(self, source: IndexSource):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class AuthorCounts(Aggregator):
+    """Message count by author id."""
+
+    indexed = True
+
+    def __init__(self, counter=Tally):
+        self.counts = counter()
+
+    def add(self, message):
+        self.counts.add(message.author.id)
+
+    def add_index(self, source):
+        for _, author_id, messages, _ in source.counts:
+            self.counts.add(author_id, messages)
+
+    def result(self):
+        return self.counts
+
+
+class ChannelCounts(Aggregator):
+    """Message count by channel id."""
+
+    indexed = True
+
+    def __init__(self):
+        self.counts = Tally()
+
+    def add(self, message):
+        self.counts[message.channel.id] += 1
+
+    def add_index(self, source):
+        for channel_id, _, messages, _ in source.counts:
+            self.counts[channel_id] += messages
+
+    def result(self):
+        return self.counts
+
+
+class ChannelAuthors(Aggregator):
+    """(message count by author id, character count by author id) by channel id."""
+
+    indexed = True
+
+    def __init__(self, counter=Tally):
+        self.counter = counter
+        self.channels = dict()
+
+    def get(self, channel_id):
+        counts = self.channels.get(channel_id)
+        if counts is None:
+            counts = self.channels[channel_id] = self.counter(), self.counter()
+        return counts
+
+    def add(self, message):
+        authors, chars = self.get(message.channel.id)
+        authors.add(message.author.id)
+        chars.add(message.author.id, len(message.content))
+
+    def add_index(self, source):
+        for channel_id, author_id, messages, character_count in source.counts:
+            authors, chars = self.get(channel_id)
+            authors.add(author_id, messages)
+            chars.add(author_id, character_count)
+
+    def result(self):
+        return self.channels
+
+
+class LastSeen(Aggregator):
+    """Datetime of the last message by author id."""
+
+    indexed = True
+
+    def __init__(self):
+        self.last_seen = dict()
+
+    def see(self, author_id, created_at):
+        previous = self.last_seen.get(author_id)
+        if previous is None or created_at > previous:
+            self.last_seen[author_id] = created_at
+
+    def add(self, message):
+        self.see(message.author.id, message.created_at)
+
+    def add_index(self, source):
+        for _, author_id, created_at in source.last_seen:
+            self.see(author_id, created_at)
+
+    def result(self):
+        return self.last_seen
+
+
+class Interactions(Aggregator):
+    """Mention and reply graph between authors."""
+
+    indexed = True
+    resolution = MESSAGE
+
+    def __init__(self):
+        self.graph = InteractionGraph()
+
+    def add(self, message):
+        reply_author_id = None
+        reference = message.reference
+        if reference is not None and isinstance(reference.resolved, discord.Message):
+            reply_author_id = reference.resolved.author.id
+        self.graph.add_message(message.author.id, [m.id for m in message.mentions], reply_author_id)
+
+    def add_index(self, source):
+        for kind, author_id, target_id, count in source.interactions:
+            self.graph.add(author_id, target_id, kind, count=count)
+
+    def result(self):
+        return self.graph
+
+
+class WordCounts(Aggregator):
+    """Bounded word and n-gram counts. The index keeps no content, so always crawled."""
+
+    def __init__(self, ngrams=(1,)):
+        self.counter = WordCounter(ngrams=ngrams)
+
+    def add(self, message):
+        self.counter.add_text(message.content)
+
+    def result(self):
+        return self.counter
+
+
+class ActivityHeatmap(Aggregator):
+    """7 × 24 array of message counts by weekday and hour."""
+
+    indexed = True
+    resolution = HOUR
+
+    def __init__(self, utc_offset=0):
+        self.utc_offset = utc_offset
+        self.times = []
+        self.hours = []
+
+    def add(self, message):
+        self.times.append(message.created_at)
+
+    def add_index(self, source):
+        self.hours = source.hourly_counts
+
+    def result(self):
+        grid = heatmap.histogram(np.array(self.times, dtype='datetime64[s]'), utc_offset=self.utc_offset)
+        if self.hours:
+            hours, counts = np.array(self.hours, dtype=np.int64).T
+            grid += heatmap.histogram(hours.astype('datetime64[h]'), weights=counts, utc_offset=self.utc_offset)
+        return grid
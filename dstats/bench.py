@@ -0,0 +1,309 @@
+"""Offline benchmarks of GuildLog against a synthetic in-memory guild.
+
+usage: python -m dstats.bench [-h] [-c CHANNELS] [-m MESSAGES] [-a AUTHORS]
+                              [--distribution {uniform,zipf}] [--latency LATENCY]
+                              [-d DAYS] [--store] [--seed SEED] [methods ...]
+
+Fake channels serve history() from pre-generated messages in pages of 100,
+sleeping `latency` seconds per page like an API request would. For every
+GuildLog method the harness reports wall time, messages per second, history
+pages requested and peak memory allocated by the method.
+"""
+import argparse
+import asyncio
+import datetime as dt
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import discord
+
+from .crawl import CrawlJob
+from .crawl import PAGE_SIZE
+from .dstats import GuildLog
+from .store import MessageStore
+
+WORDS = (
+    "the game deck card war clan chest trophy arena king tower spell push ladder "
+    "tournament challenge elixir rage freeze lightning fireball zap log golem hog "
+    "balloon miner goblin barrel wizard witch pekka prince knight archer giant"
+).split()
+
+
+class FakeRole:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.members = []
+
+
+class FakeMember:
+    def __init__(self, id, name, roles=()):
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.discriminator = "0000"
+        self.avatar_url = ""
+        self.color = discord.Color.default()
+        self.roles = list(roles)
+        self.bot = False
+
+
+class FakeReference:
+    def __init__(self, message):
+        self.message_id = message.id
+        self.resolved = message
+
+
+class FakeMessage(discord.Message):
+    """discord.Message without a connection state, so isinstance checks pass."""
+
+    def __init__(self, id, channel, author, content, mentions=(), reference=None):
+        self.id = id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+        self.reference = reference
+
+    def __repr__(self):
+        return f"<FakeMessage id={self.id}>"
+
+
+def snowflake(value, high=False):
+    """Snowflake bound of a history() before / after argument."""
+    if value is None:
+        return None
+    if isinstance(value, dt.datetime):
+        return discord.utils.time_snowflake(value, high=high)
+    return value.id
+
+
+class FakeTextChannel:
+    def __init__(self, guild, id, name, position, latency=0.0):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.position = position
+        self.mention = f"<#{id}>"
+        self.latency = latency
+        self.messages = []
+        self.pages = 0
+
+    async def history(self, limit=100, before=None, after=None, oldest_first=None):
+        """Same bounds and paging as TextChannel.history."""
+        before_id = snowflake(before)
+        after_id = snowflake(after, high=True)
+        if oldest_first is None:
+            oldest_first = after is not None
+        messages = self.messages if oldest_first else reversed(self.messages)
+        count = 0
+        for message in messages:
+            if before_id is not None and message.id >= before_id:
+                continue
+            if after_id is not None and message.id <= after_id:
+                continue
+            if limit is not None and count >= limit:
+                return
+            if count % PAGE_SIZE == 0:
+                self.pages += 1
+                await asyncio.sleep(self.latency)
+            count += 1
+            yield message
+        if count % PAGE_SIZE == 0:
+            # a short or empty last page is still a request
+            self.pages += 1
+
+
+class FakeGuild:
+    def __init__(self, id=1, name="Benchmark"):
+        self.id = id
+        self.name = name
+        self.icon_url = ""
+        self.emojis = []
+        self.filesize_limit = 8 * 2 ** 20
+        self.text_channels = []
+        self.roles = []
+        self.members = []
+        self._members = dict()
+        self._channels = dict()
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    @property
+    def pages(self):
+        return sum(c.pages for c in self.text_channels)
+
+    def reset_pages(self):
+        for channel in self.text_channels:
+            channel.pages = 0
+
+
+def weights(n, distribution):
+    """Cumulative weights of n authors or words."""
+    if distribution == 'zipf':
+        values = [1 / (rank + 1) for rank in range(n)]
+    else:
+        values = [1] * n
+    total = 0
+    cumulative = []
+    for value in values:
+        total += value
+        cumulative.append(total)
+    return cumulative
+
+
+def make_guild(channels=10, messages=1000, authors=100, distribution='zipf', days=7,
+               latency=0.0, mention_rate=0.1, reply_rate=0.1, seed=0):
+    """Guild with `messages` messages in each channel, spread over the last `days` days."""
+    rng = random.Random(seed)
+    guild = FakeGuild()
+    role = FakeRole(id=10, name="Member")
+    guild.roles.append(role)
+
+    for i in range(authors):
+        member = FakeMember(id=1000 + i, name=f"member{i}", roles=[role])
+        guild.members.append(member)
+        guild._members[member.id] = member
+        if i % 2 == 0:
+            role.members.append(member)
+
+    author_weights = weights(authors, distribution)
+    word_weights = weights(len(WORDS), 'zipf')
+    now = dt.datetime.utcnow()
+    span = dt.timedelta(days=days).total_seconds()
+    sequence = 0
+
+    for i in range(channels):
+        channel = FakeTextChannel(guild, id=100 + i, name=f"channel{i}", position=i, latency=latency)
+        guild.text_channels.append(channel)
+        guild._channels[channel.id] = channel
+
+        offsets = sorted(rng.uniform(0, span) for _ in range(messages))
+        for offset in reversed(offsets):
+            created_at = now - dt.timedelta(seconds=offset)
+            sequence += 1
+            message_id = discord.utils.time_snowflake(created_at) + sequence % (1 << 22)
+            author = rng.choices(guild.members, cum_weights=author_weights)[0]
+            content = " ".join(rng.choices(WORDS, cum_weights=word_weights, k=rng.randint(1, 12)))
+            mentions = []
+            if rng.random() < mention_rate:
+                mentions = rng.choices(guild.members, cum_weights=author_weights)
+            reference = None
+            if channel.messages and rng.random() < reply_rate:
+                reference = FakeReference(rng.choice(channel.messages[-50:]))
+            channel.messages.append(FakeMessage(message_id, channel, author, content, mentions, reference))
+    return guild
+
+
+def methods(guild, days):
+    """Benchmarked calls by name, each a function of a GuildLog."""
+    channels = guild.text_channels
+    member = guild.members[0]
+    role = guild.roles[0]
+    return {
+        'user_history': lambda glog: glog.user_history(guild, member, days=days, limit=None),
+        'members_history': lambda glog: glog.members_history(role.members, days=days, limit=None),
+        'word_counts': lambda glog: glog.word_counts(channels, days=days, limit=None, ngrams=(1, 2)),
+        'interaction_graph': lambda glog: glog.interaction_graph(channels, days=days, limit=None),
+        'channels_history': lambda glog: glog.channels_history(channels, days=days, limit=None),
+        'channel_history': lambda glog: glog.channel_history(
+            after=dt.datetime.utcnow() - dt.timedelta(days=days), limit=None),
+        'server_history': lambda glog: glog.server_history(days=days, limit=None),
+        'users_history': lambda glog: glog.users_history(days=days, limit=None),
+    }
+
+
+async def bench(guild, name, fn, store_dir=None):
+    """Run one method on a fresh GuildLog. Return a dict of measurements."""
+    store = None
+    if store_dir is not None:
+        store = MessageStore(Path(store_dir) / f"{name}.sqlite3")
+        # pretend the store was opened now, so every window is backfilled
+        store.since = time.time()
+    job = CrawlJob()
+    glog = GuildLog(guild, store=store, job=job)
+    guild.reset_pages()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        await fn(glog)
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if store is not None:
+            store.close()
+
+    return dict(
+        method=name,
+        seconds=elapsed,
+        messages=job.messages,
+        rate=job.messages / elapsed if elapsed > 0 else 0.0,
+        pages=guild.pages,
+        peak=peak,
+    )
+
+
+def format_results(results):
+    header = "{:<20} {:>9} {:>10} {:>12} {:>7} {:>10}".format(
+        "method", "seconds", "messages", "messages/s", "pages", "peak MiB")
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append("{method:<20} {seconds:>9.3f} {messages:>10,} {rate:>12,.0f} {pages:>7,} {mib:>10.2f}".format(
+            mib=r['peak'] / 2 ** 20, **r))
+    return "\n".join(lines)
+
+
+async def run(args):
+    guild = make_guild(
+        channels=args.channels,
+        messages=args.messages,
+        authors=args.authors,
+        distribution=args.distribution,
+        days=args.days,
+        latency=args.latency,
+        seed=args.seed,
+    )
+    calls = methods(guild, args.days)
+    names = args.methods or list(calls.keys())
+    unknown = set(names) - set(calls.keys())
+    if unknown:
+        raise SystemExit("Unknown methods: {}".format(", ".join(sorted(unknown))))
+    results = []
+    with tempfile.TemporaryDirectory() as store_dir:
+        for name in names:
+            results.append(await bench(guild, name, calls[name], store_dir=store_dir if args.store else None))
+    return results
+
+
+def parser():
+    p = argparse.ArgumentParser(description='Benchmark GuildLog on a synthetic guild')
+    p.add_argument('methods', nargs='*', help='GuildLog methods to run (default: all)')
+    p.add_argument('-c', '--channels', type=int, default=10, help='Text channels')
+    p.add_argument('-m', '--messages', type=int, default=2000, help='Messages per channel')
+    p.add_argument('-a', '--authors', type=int, default=200, help='Members who post')
+    p.add_argument('--distribution', choices=['uniform', 'zipf'], default='zipf',
+                   help='How messages are spread over authors')
+    p.add_argument('--latency', type=float, default=0.0, help='Seconds per history page')
+    p.add_argument('-d', '--days', type=int, default=7, help='Window of messages and reports')
+    p.add_argument('--store', action='store_true', help='Backfill a temporary message index')
+    p.add_argument('--seed', type=int, default=0, help='Random seed')
+    return p
+
+
+def main():
+    args = parser().parse_args()
+    print(format_results(asyncio.get_event_loop().run_until_complete(run(args))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 300
+DEFAULT_MAXSIZE = 32
+
+
+def normalize(value):
+    """Hashable value with the same key for equivalent arguments."""
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(normalize(v) for v in value))
+    return value
+
+
+def make_key(command, namespace=None, **extra):
+    """Cache key from subcommand name and argparse namespace.
+
+    Role names are case insensitive, so they are lowercased. The export
+    format only changes how a result is sent, so it is not part of the key.
+    """
+    items = dict(vars(namespace)) if namespace is not None else dict()
+    items.update(extra)
+    items.pop('export', None)
+    if items.get('roles'):
+        items['roles'] = [r.lower() for r in items['roles']]
+    return (command,) + tuple(sorted((k, normalize(v)) for k, v in items.items()))
+
+
+class ResultCache:
+    """TTL and LRU cache of report results with request coalescing.
+
+    Results expire `ttl` seconds after they are computed and the least
+    recently used entry is evicted beyond `maxsize`. A request for a key
+    which is still being computed awaits the same task instead of starting
+    another crawl. Failed computations are not cached.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, maxsize=DEFAULT_MAXSIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    async def get(self, key, factory):
+        """Return cached result for key or compute it with the coroutine function factory."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, task = entry
+            if expires is None or expires > time.monotonic():
+                self.entries.move_to_end(key)
+                return await asyncio.shield(task)
+            del self.entries[key]
+
+        task = asyncio.ensure_future(factory())
+        entry = [None, task]
+        self.entries[key] = entry
+        task.add_done_callback(lambda t: self.done(key, entry, t))
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return await asyncio.shield(task)
+
+    def done(self, key, entry, task):
+        if task.cancelled() or task.exception() is not None:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+            return
+        entry[0] = time.monotonic() + self.ttl
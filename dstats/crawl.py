@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+
+# Retries after discord.py gives up on a rate limited route
+MAX_RETRIES = 5
+BACKOFF_BASE = 2.0
+
+# Messages per channel history request
+PAGE_SIZE = 100
+
+
+class CrawlJob:
+    """Progress counters and cancellation flag shared by the crawls of one report.
+
+    Cancelling does not interrupt requests in flight: channel histories stop
+    after the current message and channels not started yet are skipped, so
+    the report is computed from what was fetched so far.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.messages = 0
+        self.pages = 0
+        self.rate_limit_wait = 0.0
+        self.channels_total = 0
+        self.channels_done = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        """Messages per second."""
+        elapsed = self.elapsed
+        return self.messages / elapsed if elapsed > 0 else 0.0
+
+    def status(self):
+        if self.cancelled:
+            state = "Cancelled"
+        elif self.finished is not None:
+            state = "Done"
+        else:
+            state = "Crawling"
+        return (
+            "{state}: {done}/{total} channels, {messages:,} messages ({rate:,.0f}/s), "
+            "{pages:,} API pages, {wait:.1f}s rate limited, {elapsed:.0f}s elapsed".format(
+                state=state,
+                done=self.channels_done,
+                total=self.channels_total,
+                messages=self.messages,
+                rate=self.rate,
+                pages=self.pages,
+                wait=self.rate_limit_wait,
+                elapsed=self.elapsed,
+            )
+        )
+
+
+def retry_after(error: discord.HTTPException, attempt: int) -> float:
+    """Seconds to wait before retrying a rate limited request."""
+    headers = getattr(error.response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return BACKOFF_BASE ** attempt
+
+
+async def history(channel: discord.TextChannel, after=None, before=None, limit=10000, oldest_first=False,
+                  job: CrawlJob = None):
+    """Channel history which backs off and resumes on 429 responses.
+
+    If job is given, fetched messages, pages and rate limit waits are
+    counted on it and the history stops once the job is cancelled.
+    """
+    attempt = 0
+    while True:
+        if job is not None:
+            if job.cancelled:
+                return
+            job.pages += 1
+        try:
+            fetched = 0
+            async for message in channel.history(
+                    before=before, after=after, limit=limit, oldest_first=oldest_first):
+                if job is not None:
+                    if job.cancelled:
+                        return
+                    job.messages += 1
+                    # the first page is counted before the request
+                    if fetched and fetched % PAGE_SIZE == 0:
+                        job.pages += 1
+                fetched += 1
+                if oldest_first:
+                    after = message
+                else:
+                    before = message
+                if limit is not None:
+                    limit -= 1
+                attempt = 0
+                yield message
+            return
+        except discord.HTTPException as e:
+            if e.status != 429 or attempt >= MAX_RETRIES:
+                raise
+            attempt += 1
+            delay = retry_after(e, attempt)
+            if job is not None:
+                job.rate_limit_wait += delay
+            logger.warning("Rate limited on #{}, retrying in {:.1f}s".format(channel.name, delay))
+            await asyncio.sleep(delay)
+        if limit is not None and limit <= 0:
+            return
+
+
+async def run_channels(channels, visit, concurrency=DEFAULT_CONCURRENCY, job: CrawlJob = None):
+    """Run visit(channel) for several channels at once.
+
+    At most `concurrency` channels are visited at the same time. Yields
+    (channel, result) in completion order. Channels which cannot be read
+    are logged and skipped, as are channels not started when job is cancelled.
+    """
+    semaphore = asyncio.Semaphore(max(1, min(concurrency, MAX_CONCURRENCY)))
+    if job is not None:
+        job.channels_total += len(channels)
+
+    async def run(channel):
+        async with semaphore:
+            if job is not None and job.cancelled:
+                return channel, None
+            try:
+                return channel, await visit(channel)
+            except discord.Forbidden:
+                logger.warning("No permission for {}: {}".format(channel.name, channel.id))
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                if job is not None:
+                    job.channels_done += 1
+            return channel, None
+
+    for future in asyncio.as_completed([run(channel) for channel in channels]):
+        channel, result = await future
+        if result is not None:
+            yield channel, result
+
+
+async def crawl(channels, fold, concurrency=DEFAULT_CONCURRENCY, job: CrawlJob = None, **kwargs):
+    """Fold the history of several channels at once.
+
+    fold(channel, messages) is a coroutine which consumes the async iterator
+    of messages and returns a partial aggregate for that channel. Yields
+    (channel, partial) in completion order so callers can merge as they go.
+    """
+    async def visit(channel):
+        return await fold(channel, history(channel, job=job, **kwargs))
+
+    async for channel, partial in run_channels(channels, visit, concurrency=concurrency, job=job):
+        yield channel, partial
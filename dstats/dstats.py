@@ -1,25 +1,81 @@
 import argparse
+import asyncio
 import datetime as dt
 import itertools
 import logging
 import re
-from collections import Counter
+import time
+from collections import defaultdict
 from collections import OrderedDict
 from random import choice
 
 import discord
 import humanize
+from discord.ext import tasks
 from redbot.core import Config
 from redbot.core import checks
 from redbot.core import commands
 from redbot.core.bot import Red
 from redbot.core.commands import Context
-
-from .stopwords import stop_words
+from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.chat_formatting import box
+from redbot.core.utils.chat_formatting import pagify
+from redbot.core.utils.menus import DEFAULT_CONTROLS
+from redbot.core.utils.menus import menu
+
+from . import heatmap
+from .aggregate import ActivityHeatmap
+from .aggregate import AuthorCounts
+from .aggregate import ChannelAuthors
+from .aggregate import ChannelCounts
+from .aggregate import IndexSource
+from .aggregate import Interactions
+from .aggregate import LastSeen
+from .aggregate import Tally
+from .aggregate import WordCounts
+from .cache import DEFAULT_TTL
+from .cache import ResultCache
+from .cache import make_key
+from .crawl import CrawlJob
+from .crawl import DEFAULT_CONCURRENCY
+from .crawl import MAX_CONCURRENCY
+from .crawl import crawl
+from .crawl import history
+from .crawl import run_channels
+from .export import EXPORT_FORMATS
+from .export import available as export_available
+from .export import export
+from .graph import InteractionGraph
+from .graph import MENTIONS
+from .graph import REPLIES
+from .importer import ExportFile
+from .importer import export_files
+from .importer import import_export
+from .lastseen import LastSeenIndex
+from .sketch import ApproximateCounter
+from .store import MessageRecord
+from .store import MessageStore
+from .store import from_timestamp
+from .store import to_timestamp
+from .textfilter import TextFilter
+from .utils import EmojiIndex
 from .utils import get_emoji
+from .words import WordCounter
 
 logger = logging.getLogger(__name__)
 
+# Seconds before a crawl reports progress, and between progress updates
+PROGRESS_INTERVAL = 5
+
+# Hours between runs of index retention
+COMPACT_INTERVAL_HOURS = 6
+
+NGRAM_NAMES = {
+    1: "Word",
+    2: "Bigram",
+    3: "Trigram",
+}
+
 
 def random_discord_color():
     """Return random color as an integer."""
@@ -67,9 +123,174 @@ def parser():
     )
     parser.add_argument(
         '-t', '--text',
-        help='Text match',
-        type=str,
-        default=''
+        nargs='+',
+        help='Only count messages containing any of these terms'
+    )
+    parser.add_argument(
+        '--regex',
+        action='store_true',
+        help='Text terms are regular expressions'
+    )
+    parser.add_argument(
+        '--case-sensitive',
+        action='store_true',
+        help='Match text terms case sensitively'
+    )
+    parser.add_argument(
+        '-a', '--approximate',
+        action='store_true',
+        help='Count authors in fixed memory with bounded error'
+    )
+    parser.add_argument(
+        '-e', '--export',
+        choices=EXPORT_FORMATS,
+        help='Send complete results as a compressed file'
+    )
+    return parser
+
+
+def words_parser():
+    """Word count argument parser."""
+    parser = argparse.ArgumentParser(prog='[p]dstats words')
+    parser.add_argument(
+        '-s', '--scope',
+        choices=['channel', 'guild'],
+        default='channel',
+        help='Current channel or all channels'
+    )
+    parser.add_argument(
+        '-u', '--user',
+        help='Only count words by this member'
+    )
+    parser.add_argument(
+        '-g', '--ngrams',
+        nargs='+',
+        type=int,
+        choices=[1, 2, 3],
+        default=[1],
+        help='Words, bigrams and / or trigrams'
+    )
+    parser.add_argument(
+        '-n', '--top',
+        help='Top N results',
+        type=int,
+        default=50
+    )
+    parser.add_argument(
+        '-d', '--days',
+        help='Last N days',
+        type=int,
+        default=7
+    )
+    parser.add_argument(
+        '-l', '--limit',
+        help='Limit N messages per channel',
+        type=int,
+        default=10000
+    )
+    parser.add_argument(
+        '-e', '--export',
+        choices=EXPORT_FORMATS,
+        help='Send complete results as a compressed file'
+    )
+    return parser
+
+
+def interactions_parser():
+    """Mentions and replies argument parser."""
+    parser = argparse.ArgumentParser(prog='[p]dstats interactions')
+    parser.add_argument(
+        '-s', '--scope',
+        choices=['channel', 'guild'],
+        default='guild',
+        help='Current channel or all channels'
+    )
+    parser.add_argument(
+        '-n', '--top',
+        help='Top N results',
+        type=int,
+        default=25
+    )
+    parser.add_argument(
+        '-d', '--days',
+        help='Last N days',
+        type=int,
+        default=7
+    )
+    parser.add_argument(
+        '-l', '--limit',
+        help='Limit N messages per channel',
+        type=int,
+        default=10000
+    )
+    parser.add_argument(
+        '-e', '--export',
+        choices=EXPORT_FORMATS,
+        help='Send complete results as a compressed file'
+    )
+    return parser
+
+
+def heatmap_parser():
+    """Activity heatmap argument parser."""
+    parser = argparse.ArgumentParser(prog='[p]dstats heatmap')
+    parser.add_argument(
+        '-c', '--channel',
+        help='Only count messages in this channel'
+    )
+    parser.add_argument(
+        '-r', '--role',
+        help='Only count messages by members with this role'
+    )
+    parser.add_argument(
+        '-u', '--user',
+        help='Only count messages by this member'
+    )
+    parser.add_argument(
+        '-z', '--utc-offset',
+        help='Hours from UTC of the time zone to show',
+        type=int,
+        choices=range(-12, 15),
+        metavar='{-12..14}',
+        default=0
+    )
+    parser.add_argument(
+        '-d', '--days',
+        help='Last N days',
+        type=int,
+        default=28
+    )
+    parser.add_argument(
+        '-l', '--limit',
+        help='Limit N messages per channel',
+        type=int,
+        default=10000
+    )
+    parser.add_argument(
+        '-e', '--export',
+        choices=EXPORT_FORMATS,
+        help='Send counts as a compressed file instead of a table'
+    )
+    return parser
+
+
+def inactive_parser():
+    """Inactive members argument parser."""
+    parser = argparse.ArgumentParser(prog='[p]dstats inactive')
+    parser.add_argument(
+        '-d', '--days',
+        help='Silent for at least N days',
+        type=int,
+        default=30
+    )
+    parser.add_argument(
+        '-r', '--role',
+        help='Only list members with this role'
+    )
+    parser.add_argument(
+        '-e', '--export',
+        choices=EXPORT_FORMATS,
+        help='Send the list as a compressed file instead of a menu'
     )
     return parser
 
@@ -87,27 +308,229 @@ def get_guild_roles(guild: discord.Guild, names):
 
 
 class GuildLog:
-    def __init__(self, guild):
+    def __init__(self, guild, store: MessageStore = None, concurrency=DEFAULT_CONCURRENCY, job: CrawlJob = None,
+                 approximate=False, last_seen: LastSeenIndex = None):
         self.guild = guild
+        self.store = store
+        self.last_seen = last_seen
+        self.concurrency = concurrency
+        self.job = job or CrawlJob()
+        self.approximate = approximate
+        self.sketches = []
+        self.partial = dict()
+        # (unit, datetime) when the window starts where the index only keeps rollups of unit
+        self.rounded = None
+
+    def counter(self):
+        """Counter for author aggregates, an ApproximateCounter in approximate mode."""
+        if not self.approximate:
+            return Tally()
+        counter = ApproximateCounter()
+        self.sketches.append(counter)
+        return counter
+
+    async def use_store(self, after, channels=None, limit=10000, text=None):
+        """Bring the index up to date for the window.
+
+        Return True if the query can be answered by the local index. The
+        index keeps no message content, so text matches always go to the API.
+        """
+        if text or self.store is None or after is None:
+            return False
+        if channels is None:
+            channels = self.guild.text_channels
+        channels = [c for c in channels if not self.store.covers_channel(c.id, after)]
+
+        async def visit(channel):
+            return await self.sync_channel(channel, after, limit=limit)
+
+        async for _ in run_channels(channels, visit, concurrency=self.concurrency, job=self.job):
+            pass
+
+        self.partial = dict()
+        for channel in channels:
+            cursor = self.store.cursor(channel.id)
+            if cursor is not None and not self.store.covers_channel(channel.id, after):
+                self.partial[channel.id] = cursor[0]
+        return True
+
+    def coverage_note(self):
+        """Message about cancelled crawls, incomplete backfills, day resolution counts and approximate counts."""
+        notes = []
+        if self.job.cancelled:
+            notes.append("Crawl cancelled, results only include messages fetched before that.")
+        elif self.partial:
+            oldest = from_timestamp(max(self.partial.values()))
+            notes.append(
+                "Backfill in progress: {count} channel(s) are only counted back to {date}. "
+                "Run the command again to fetch older messages.".format(
+                    count=len(self.partial),
+                    date=oldest.strftime('%a, %b %d, %Y, %H:%M UTC'),
+                )
+            )
+        if self.rounded is not None:
+            unit, date = self.rounded
+            notes.append(
+                "Counts before {date} are kept per {unit}, the first {unit} of the window is counted whole.".format(
+                    unit=unit,
+                    date=date.strftime('%a, %b %d, %Y, %H:%M UTC'),
+                )
+            )
+        if self.sketches:
+            notes.append(
+                "Approximate counts: author totals are within ±{error:.1%} and message counts "
+                "are overestimated by at most {bound}.".format(
+                    error=self.sketches[0].distinct.error,
+                    bound=max(sketch.error_bound() for sketch in self.sketches),
+                )
+            )
+        return "\n".join(notes) or None
+
+    async def sync_channel(self, channel: discord.TextChannel, after, limit=10000):
+        """Fetch the messages of channel missing from the index for the window.
+
+        Only the delta since the cursor and the part of the window older than
+        the cursor are fetched, then the cursor is moved to cover the window.
+        `limit` caps how many older messages are fetched per call, so long
+        windows are backfilled over several runs instead of being truncated.
+        """
+        store = self.store
+        # messages older than the retention period are not indexed again
+        after_ts = max(to_timestamp(after), store.compacted_before)
+        after = from_timestamp(after_ts)
+        now = dt.datetime.utcnow()
+        cursor = store.cursor(channel.id)
+        count = 0
+
+        if cursor is None:
+            # the listener has added every message since the store was opened
+            oldest, newest_id = store.since, discord.utils.time_snowflake(now)
+        else:
+            oldest, newest_id = cursor
+            if channel.id not in store.live:
+                if newest_id is None:
+                    delta_after = from_timestamp(oldest)
+                else:
+                    delta_after = discord.Object(id=newest_id)
+                async for message in history(
+                        channel, after=delta_after, limit=None, oldest_first=True, job=self.job):
+                    store.add(MessageRecord.from_message(message))
+                    newest_id = max(newest_id or 0, message.id)
+                    count += 1
+                if self.job.cancelled:
+                    # keep the old cursor, the delta is fetched again next time
+                    return count
+                newest_id = max(newest_id or 0, discord.utils.time_snowflake(now))
+
+        if oldest > after_ts:
+            backfill_count = 0
+            backfill_oldest = None
+            async for message in history(
+                    channel, after=after, before=from_timestamp(oldest), limit=limit, oldest_first=False,
+                    job=self.job):
+                record = MessageRecord.from_message(message)
+                store.add(record)
+                backfill_oldest = record.created_at
+                backfill_count += 1
+            if self.job.cancelled or (limit is not None and backfill_count >= limit):
+                if backfill_oldest is not None:
+                    oldest = backfill_oldest
+            else:
+                oldest = after_ts
+            count += backfill_count
+
+        store.set_cursor(channel.id, oldest, newest_id)
+        return count
+
+    def author_name(self, author_id):
+        member = self.guild.get_member(author_id)
+        if member:
+            return member.display_name
+        return author_id
+
+    def crawl(self, fold, channels=None, **kwargs):
+        """Crawl text channels concurrently, see crawl.crawl."""
+        if channels is None:
+            channels = self.guild.text_channels
+        return crawl(channels, fold, concurrency=self.concurrency, job=self.job, **kwargs)
+
+    @staticmethod
+    def role_member_ids(roles):
+        """Ids of members with any of roles, or None if roles is empty."""
+        if not roles:
+            return None
+        return set(m.id for role in roles for m in role.members)
+
+    async def aggregate(self, aggregators, channels=None, after=None, limit=10000, author_ids=None, text=None,
+                        oldest_first=False):
+        """Feed one pass over the messages of channels to several aggregators.
+
+        aggregators maps names to Aggregator instances. Messages come from the
+        index if it covers the window and every aggregator can be read from
+        it, otherwise from one concurrent crawl. Only messages by author_ids
+        and matching the text filter are counted, if given.
+        Return {name: result}.
+        """
+        if channels is None:
+            channels = self.guild.text_channels
+        indexed = all(
+            aggregator.indexed and (self.store is None or self.store.retains(after, aggregator.resolution))
+            for aggregator in aggregators.values()
+        )
+
+        if indexed and await self.use_store(after, channels=channels, limit=limit, text=text):
+            channel_ids = None
+            if len(channels) != len(self.guild.text_channels):
+                channel_ids = set(c.id for c in channels)
+            source = IndexSource(self.store, after, channel_ids=channel_ids, author_ids=author_ids)
+            after_ts = to_timestamp(after)
+            if after_ts < self.store.hourly_before and after_ts % 86400:
+                self.rounded = "day", from_timestamp(self.store.hourly_before)
+            elif after_ts < self.store.compacted_before and after_ts % 3600:
+                self.rounded = "hour", from_timestamp(self.store.compacted_before)
+
+            def feed():
+                for aggregator in aggregators.values():
+                    aggregator.add_index(source)
+
+            # the index queries run in the store's worker thread, off the event loop
+            await self.store.read(feed)
+        else:
+            consumers = [aggregator.add for aggregator in aggregators.values()]
+
+            async def fold(channel, messages):
+                count = 0
+                async for message in messages:
+                    if author_ids is not None and message.author.id not in author_ids:
+                        continue
+                    if text is not None and not text(message.content):
+                        continue
+                    for add in consumers:
+                        add(message)
+                    count += 1
+                return count
+
+            async for _ in self.crawl(fold, channels=channels, after=after, limit=limit, oldest_first=oldest_first):
+                pass
+
+        return {name: aggregator.result() for name, aggregator in aggregators.items()}
 
     async def user_history(self, guild: discord.Guild, member: discord.Member, days=2, limit=10000):
         """User history in a guild."""
         after = dt.datetime.utcnow() - dt.timedelta(days=days)
-        last_seen = None
-        history = OrderedDict()
-        for channel in guild.text_channels:
-            try:
-                async for message in channel.history(after=after, limit=limit, oldest_first=False):
-                    if message.author == member:
-                        if channel.id not in history:
-                            history[channel.id] = 0
-                        history[channel.id] += 1
-                        if last_seen is None:
-                            last_seen = message.created_at
-                        last_seen = max(last_seen, message.created_at)
-            except discord.errors.Forbidden as e:
-                logger.exception("No permission for {}: {}".format(channel.name, channel.id))
-        return last_seen, OrderedDict(sorted(history.items(), key=lambda item: item[1], reverse=True))
+        results = await self.aggregate(
+            dict(channels=ChannelCounts(), last_seen=LastSeen()),
+            channels=guild.text_channels, after=after, limit=limit, author_ids={member.id},
+        )
+        history = results['channels'].most_common()
+        return self.member_last_seen(results['last_seen'], [member.id])[member.id], OrderedDict(history)
+
+    def member_last_seen(self, last_seen, member_ids):
+        """Last seen datetime by member id, from the window or the last seen index which knows older messages."""
+        if self.last_seen is None or self.store is None:
+            return {member_id: last_seen.get(member_id) for member_id in member_ids}
+        self.last_seen.update(self.guild.id, last_seen)
+        return {member_id: self.last_seen.get(self.guild.id, member_id) for member_id in member_ids}
 
     async def user_history_embed(self, member: discord.Member, days=2, limit=10000):
         last_seen, history = await self.user_history(self.guild, member, days, limit)
@@ -148,21 +571,89 @@ class GuildLog:
 
         return em
 
+    async def members_history(self, members, days=7, limit=10000):
+        """Message count and last seen for several members in one pass.
+
+        Return list of (member, count, last_seen) sorted by count.
+        """
+        after = dt.datetime.utcnow() - dt.timedelta(days=days)
+        results = await self.aggregate(
+            dict(counts=AuthorCounts(), last_seen=LastSeen()),
+            after=after, limit=limit, author_ids=set(m.id for m in members),
+        )
+
+        last_seen = self.member_last_seen(results['last_seen'], [m.id for m in members])
+        results = [
+            (member, results['counts'].get(member.id, 0), last_seen.get(member.id))
+            for member in members
+        ]
+        results.sort(key=lambda item: (item[1], item[2] or dt.datetime.min), reverse=True)
+        return results
+
+    def members_history_embeds(self, results, title=None, days=7, per_page=20):
+        """Paginated leaderboard embeds from members_history."""
+        now = dt.datetime.utcnow()
+        total_count = sum(count for _, count, _ in results)
+        active_count = len([1 for _, count, _ in results if count > 0])
+        pages = list(grouper(per_page, enumerate(results, 1)))
+        embeds = []
+        for page, items in enumerate(pages, 1):
+            lines = []
+            for rank, (member, count, last_seen) in items:
+                if last_seen is None:
+                    seen = "not seen"
+                else:
+                    seen = humanize.naturaltime(now - last_seen)
+                lines.append(f"`{rank:>3}` {discord.utils.escape_markdown(member.display_name)}: {count} ({seen})")
+            em = discord.Embed(
+                title=title or self.guild.name,
+                description=f"Message count and last seen in the last {days} days.\n\n" + "\n".join(lines),
+                color=discord.Color.red()
+            )
+            em.add_field(name="Members", value=f"{len(results)}")
+            em.add_field(name="Active", value=f"{active_count}")
+            em.add_field(name="Messages", value=f"{total_count}")
+            em.set_footer(text=f"Page {page}/{len(pages)}", icon_url=self.guild.icon_url)
+            embeds.append(em)
+        return embeds
+
+    async def word_counts(self, channels, member: discord.Member = None, days=7, limit=10000, ngrams=(1,)):
+        """Stream messages of channels through a bounded word counter."""
+        after = dt.datetime.utcnow() - dt.timedelta(days=days)
+        results = await self.aggregate(
+            dict(words=WordCounts(ngrams=ngrams)),
+            channels=channels, after=after, limit=limit,
+            author_ids={member.id} if member is not None else None,
+        )
+        return results['words']
+
+    async def activity_heatmap(self, channels, days=28, limit=10000, member_ids=None, utc_offset=0):
+        """7 × 24 array of message counts by weekday and hour in channels.
+
+        member_ids optionally restricts counts to a set of authors.
+        """
+        after = dt.datetime.utcnow() - dt.timedelta(days=days)
+        results = await self.aggregate(
+            dict(heatmap=ActivityHeatmap(utc_offset=utc_offset)),
+            channels=channels, after=after, limit=limit, author_ids=member_ids,
+        )
+        return results['heatmap']
+
+    async def interaction_graph(self, channels, days=7, limit=10000):
+        """Who mentions or replies to whom in channels, from one crawl or the index."""
+        after = dt.datetime.utcnow() - dt.timedelta(days=days)
+        results = await self.aggregate(dict(graph=Interactions()), channels=channels, after=after, limit=limit)
+        return results['graph']
+
     async def channel_history(self, after=None, limit=10000):
         history = []
-        for channel in self.guild.text_channels:
-            authors = []
-            try:
-                async for message in channel.history(after=after, limit=limit, oldest_first=False):
-                    authors.append(message.author)
-                if len(authors) > 0:
-                    history.append({
-                        'channel_id': channel.id,
-                        'rank': Counter(authors).most_common(),
-                        'count': len(authors)
-                    })
-            except Exception as e:
-                logger.exception(e)
+        async for channel_id, authors, _ in self.channels_authors(self.guild.text_channels, after, limit=limit):
+            if len(authors) > 0:
+                history.append({
+                    'channel_id': channel_id,
+                    'rank': authors.most_common(),
+                    'count': authors.total
+                })
         history = sorted(history, key=lambda item: item['count'], reverse=True)
         return history
 
@@ -184,7 +675,7 @@ class GuildLog:
             em.set_footer(text=self.guild.name, icon_url=self.guild.icon_url)
             for item in log_groups:
                 name = "{}: {}".format(self.guild.get_channel(item['channel_id']).name, item['count'])
-                value = ' - '.join(['{} {}'.format(author.display_name, count) for author, count in item['rank']])
+                value = ' - '.join(['{} {}'.format(self.author_name(author_id), count) for author_id, count in item['rank']])
                 if len(value) > 1000:
                     value = value[:1000]
                 em.add_field(name=name, value=value, inline=False)
@@ -200,6 +691,51 @@ class GuildLog:
 
         return embeds
 
+    async def channels_authors(self, channels, after, limit=10000, roles=None, text=None, oldest_first=False):
+        """Yield (channel id, message count by author id, character count by author id).
+
+        Channels without matching messages are skipped.
+        """
+        results = await self.aggregate(
+            dict(channels=ChannelAuthors(self.counter)),
+            channels=channels, after=after, limit=limit,
+            author_ids=self.role_member_ids(roles), text=text, oldest_first=oldest_first,
+        )
+        for channel in channels:
+            if channel.id in results['channels']:
+                authors, author_char_count = results['channels'][channel.id]
+                yield channel.id, authors, author_char_count
+
+    def make_channel_history_embeds(self, channel, authors, author_char_count, days=7, text=None,
+                                    enable_char_count=False):
+        """List of embeds for one channel from author counts."""
+        history = []
+        if len(authors) > 0:
+            history.append({
+                'channel_id': channel.id,
+                'rank': authors.most_common(),
+                'count': authors.total,
+            })
+
+        author_char_count_list = []
+        if enable_char_count:
+            for uid, count in author_char_count.most_common():
+                author_char_count_list.append(dict(
+                    id=uid,
+                    name=self.author_name(uid),
+                    count=count
+                ))
+
+        return self.get_channel_history_embeds(
+            history=history,
+            days=days,
+            text=text,
+            author_count=len(authors),
+            message_count=authors.total,
+            author_char_count_list=author_char_count_list,
+            enable_char_count=enable_char_count,
+        )
+
     async def channel_history_embeds(
             self,
             channel: discord.TextChannel,
@@ -210,122 +746,127 @@ class GuildLog:
             enable_char_count=False,
     ):
         """List of embeds with one channel history."""
-        after = dt.datetime.utcnow() - dt.timedelta(days=days)
-
-        history = []
-        authors = []
-        author_ids = set()
-        message_count = 0
-        character_count = 0
-        author_char_count = dict()
-
-        if roles is None:
-            roles = []
+        embeds = await self.channels_history_embeds(
+            [channel], limit=limit, days=days, roles=roles, text=text, enable_char_count=enable_char_count
+        )
+        return embeds
 
-        try:
-            async for message in channel.history(after=after, limit=limit):
-                add_it = False
-                if text is not None and text not in message.content:
-                    # add_it = False
-                    continue
+    async def channels_history_embeds(
+            self,
+            channels,
+            limit=10000,
+            days=7,
+            roles=None,
+            text=None,
+            enable_char_count=False,
+    ):
+        """List of embeds with history of several channels, in the order given."""
+        results = await self.channels_history(channels, limit=limit, days=days, roles=roles, text=text)
+        return self.make_channels_history_embeds(
+            channels, results, days=days, text=text, enable_char_count=enable_char_count
+        )
 
-                # if not getattr(message.author, 'roles', False):
-                #     continue
+    async def channels_history(self, channels, limit=10000, days=7, roles=None, text=None):
+        """{channel id: (message count by author id, character count by author id)}."""
+        after = dt.datetime.utcnow() - dt.timedelta(days=days)
+        results = dict()
+        async for channel_id, authors, author_char_count in self.channels_authors(
+                channels, after, limit=limit, roles=roles, text=text, oldest_first=True):
+            results[channel_id] = authors, author_char_count
+        return results
+
+    def make_channels_history_embeds(self, channels, results, days=7, text=None, enable_char_count=False):
+        """List of embeds from channels_history, in the order of channels."""
+        embeds = []
+        for channel in channels:
+            if channel.id not in results:
+                continue
+            authors, author_char_count = results[channel.id]
+            embeds += self.make_channel_history_embeds(
+                channel, authors, author_char_count, days=days, text=text, enable_char_count=enable_char_count
+            )
+        return embeds
 
-                if len(roles) == 0 or any([author_role in roles for author_role in message.author.roles]):
-                    add_it = True
+    def channels_history_export(self, channels, results):
+        """Columns and rows of channels_history."""
+        columns = ['channel_id', 'channel', 'author_id', 'author', 'messages', 'characters']
 
-                if not add_it:
+        def rows():
+            for channel in channels:
+                if channel.id not in results:
                     continue
+                authors, author_char_count = results[channel.id]
+                for author_id, count in authors.most_common():
+                    yield (
+                        channel.id, channel.name, author_id, str(self.author_name(author_id)),
+                        count, author_char_count.get(author_id, 0)
+                    )
 
-                authors.append(message.author)
-                author_ids.add(message.author.id)
-                message_count += 1
-
-                if enable_char_count:
-                    character_count = len(message.content)
-                    if message.author.id not in author_char_count:
-                        author_char_count[message.author.id] = 0
-                    author_char_count[message.author.id] += character_count
-
-            if len(authors) > 0:
-                history.append({
-                    'channel_id': channel.id,
-                    'rank': Counter(authors).most_common(),
-                    'count': len(authors),
-                })
-        except Exception as e:
-            logger.exception(e)
+        return columns, rows()
 
-        history = sorted(history, key=lambda item: item['count'], reverse=True)
+    def server_history_export(self, history):
+        """Columns and rows of server_history."""
+        columns = ['type', 'id', 'name', 'messages']
 
-        author_char_count_list = []
-        for k, v in author_char_count.items():
-            uid = k
-            member = channel.guild.get_member(k)
-            if member:
-                name = member.display_name
-            else:
-                name = uid
-            count = v
-            author_char_count_list.append(dict(
-                id=uid,
-                name=name,
-                count=count
-            ))
+        def rows():
+            for channel_id, count in history.get('channels', {}).items():
+                channel = self.guild.get_channel(channel_id)
+                yield 'channel', channel_id, channel.name if channel else None, count
+            for author_id, count in history.get('authors', {}).items():
+                yield 'author', author_id, str(self.author_name(author_id)), count
 
-        author_char_count_list.sort(key=lambda item: item['count'], reverse=True)
+        return columns, rows()
 
-        return self.get_channel_history_embeds(
-            history=history,
-            days=days,
-            text=text,
-            author_count=len(author_ids),
-            message_count=message_count,
-            author_char_count_list=author_char_count_list,
-            enable_char_count=enable_char_count,
+    def users_history_export(self, items):
+        """Columns and rows of users_history."""
+        columns = ['rank', 'author_id', 'author', 'messages']
+        rows = (
+            (item['rank'], item['author_id'], str(self.author_name(item['author_id'])), item['count'])
+            for item in items
+        )
+        return columns, rows
+
+    def word_counts_export(self, counter: WordCounter):
+        """Columns and rows of word_counts. Counts are overestimated by at most error."""
+        columns = ['ngram', 'term', 'count', 'error']
+        rows = (
+            (n, term, count, counter.counters[n].error(term))
+            for n in counter.ngrams
+            for term, count in counter.counters[n].most_common()
+        )
+        return columns, rows
+
+    def interaction_graph_export(self, graph: InteractionGraph):
+        """Columns and rows of interaction_graph edges."""
+        columns = ['kind', 'source_id', 'source', 'target_id', 'target', 'count']
+        rows = (
+            (
+                kind, source_id, str(self.author_name(source_id)),
+                target_id, str(self.author_name(target_id)), count
+            )
+            for kind, edges in graph.edges.items()
+            for source_id, targets in edges.items()
+            for target_id, count in targets.items()
         )
+        return columns, rows
 
     async def server_history(self, limit=10000, days=7, roles=None, text=None):
         after = dt.datetime.utcnow() - dt.timedelta(days=days)
-        authors = dict()
-        channels = dict()
-        try:
-            for channel in self.guild.text_channels:
-                async for message in channel.history(after=after, limit=limit, oldest_first=False):
-                    author = message.author
-                    if author.id not in authors:
-                        authors[author.id] = 0
-                    authors[author.id] += 1
-
-                    if channel.id not in channels:
-                        channels[channel.id] = 0
-                    channels[channel.id] += 1
-
-        except Exception as e:
-            logger.exception(e)
-
-        return dict(authors=authors, channels=channels)
+        results = await self.aggregate(
+            dict(authors=AuthorCounts(self.counter), channels=ChannelCounts()),
+            after=after, limit=limit, author_ids=self.role_member_ids(roles), text=text,
+        )
+        return dict(authors=dict(results['authors']), channels=dict(results['channels']))
 
     async def users_history(self, limit=10000, days=7, roles=None, text=None):
         after = dt.datetime.utcnow() - dt.timedelta(days=days)
-        authors = dict()
-        try:
-            for channel in self.guild.text_channels:
-                async for message in channel.history(after=after, limit=limit, oldest_first=False):
-                    if text is not None:
-                        if text.lower() not in message.content.lower():
-                            continue
-                    author = message.author
-                    if author.id not in authors:
-                        authors[author.id] = 0
-                    authors[author.id] += 1
-
-        except Exception as e:
-            logger.exception(e)
+        results = await self.aggregate(
+            dict(authors=AuthorCounts(self.counter)),
+            after=after, limit=limit, author_ids=self.role_member_ids(roles), text=text,
+        )
 
         items = []
-        for author_id, count in authors.items():
+        for author_id, count in results['authors'].items():
             items.append(dict(
                 author_id=author_id,
                 count=count
@@ -348,160 +889,788 @@ class DStats(commands.Cog):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=209287691722817536, force_registration=True)
         default_global = {}
-        default_guild = {}
+        default_guild = {
+            'index': False,
+            'concurrency': DEFAULT_CONCURRENCY,
+            'cache_ttl': DEFAULT_TTL,
+            'retention_days': 0,
+            'hourly_retention_days': 0,
+        }
         self.config.register_global(**default_global)
         self.config.register_guild(**default_guild)
+        self.stores = dict()
+        self.caches = dict()
+        self.jobs = defaultdict(set)
+        self.emoji_index = EmojiIndex(bot)
+        self.last_seen = LastSeenIndex(cog_data_path(self) / "last_seen.db")
+        self.flush_stores_task.start()
+        self.compact_stores_task.start()
+
+    def cog_unload(self):
+        self.flush_stores_task.cancel()
+        self.compact_stores_task.cancel()
+        for store in self.stores.values():
+            store.close()
+        self.stores = dict()
+        self.last_seen.close()
+
+    async def get_store(self, guild: discord.Guild):
+        """Message index for guild, or None if indexing is not enabled."""
+        if guild is None:
+            return None
+        if not await self.config.guild(guild).index():
+            return None
+        store = self.stores.get(guild.id)
+        if store is None:
+            store = MessageStore(cog_data_path(self) / f"{guild.id}.sqlite3")
+            self.stores[guild.id] = store
+            self.last_seen.update(guild.id, await store.read(store.last_seen, from_timestamp(0)))
+        return store
+
+    async def guild_log(self, guild: discord.Guild, job: CrawlJob = None, approximate=False):
+        store = await self.get_store(guild)
+        return GuildLog(
+            guild,
+            store=store,
+            concurrency=await self.config.guild(guild).concurrency(),
+            job=job,
+            approximate=approximate,
+            # last seen is only tracked for guilds with the message index
+            last_seen=self.last_seen if store is not None else None,
+        )
+
+    @staticmethod
+    async def show_progress(ctx: Context, job: CrawlJob, state):
+        """Send job status after PROGRESS_INTERVAL seconds and keep editing the same message."""
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            if state.get('message') is None:
+                state['message'] = await ctx.send(job.status())
+            else:
+                await state['message'].edit(content=job.status())
+
+    async def run_report(self, ctx: Context, key, fn, approximate=False):
+        """Run fn(glog) through the guild result cache.
+
+        Identical reports requested within the cache TTL share one result,
+        and concurrent identical requests share one crawl. Crawls taking
+        longer than PROGRESS_INTERVAL seconds report progress in one message
+        which is edited until the crawl is done or cancelled.
+        Return (result, coverage note).
+        """
+        async def factory():
+            job = CrawlJob()
+            jobs = self.jobs[ctx.guild.id]
+            jobs.add(job)
+            state = dict()
+            progress = asyncio.ensure_future(self.show_progress(ctx, job, state))
+            try:
+                glog = await self.guild_log(ctx.guild, job=job, approximate=approximate)
+                result = await fn(glog)
+            finally:
+                jobs.discard(job)
+                job.finish()
+                progress.cancel()
+                if state.get('message') is not None:
+                    try:
+                        await state['message'].edit(content=job.status())
+                    except discord.HTTPException:
+                        pass
+            if job.cancelled:
+                # partial results are returned but not cached
+                cache = self.caches.get(ctx.guild.id)
+                if cache is not None:
+                    cache.discard(key)
+            return result, glog.coverage_note()
+
+        ttl = await self.config.guild(ctx.guild).cache_ttl()
+        if ttl <= 0:
+            return await factory()
+        cache = self.caches.get(ctx.guild.id)
+        if cache is None:
+            cache = self.caches[ctx.guild.id] = ResultCache()
+        cache.ttl = ttl
+        return await cache.get(key, factory)
+
+    @staticmethod
+    async def send_coverage_note(ctx: Context, note):
+        if note:
+            await ctx.send(note)
+
+    @staticmethod
+    async def send_export(ctx: Context, fmt, name, export_rows):
+        """Send (columns, rows) as a compressed file attachment."""
+        if not export_available(fmt):
+            await ctx.send("Parquet export requires pyarrow.")
+            return
+        columns, rows = export_rows
+        fp, filename = export(rows, columns, fmt, name)
+        size = len(fp.getbuffer())
+        if size > ctx.guild.filesize_limit:
+            await ctx.send(
+                f"Export is {size / 2 ** 20:.1f} MiB, more than the upload limit of this server. "
+                "Use a smaller range with -d or -l."
+            )
+            return
+        await ctx.send(file=discord.File(fp, filename=filename))
+
+    @tasks.loop(seconds=30)
+    async def flush_stores_task(self):
+        for store in self.stores.values():
+            store.flush()
+        self.last_seen.flush()
+
+    @tasks.loop(hours=COMPACT_INTERVAL_HOURS)
+    async def compact_stores_task(self):
+        """Apply the retention settings of every indexed guild."""
+        for guild_id, settings in (await self.config.all_guilds()).items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None or not settings['retention_days'] and not settings['hourly_retention_days']:
+                continue
+            store = await self.get_store(guild)
+            if store is None:
+                continue
+            try:
+                deleted, downsampled = await store.compact(
+                    retention_days=settings['retention_days'],
+                    hourly_retention_days=settings['hourly_retention_days'],
+                )
+            except Exception:
+                logger.exception(f"Cannot compact message index of {guild_id}")
+                continue
+            if deleted or downsampled:
+                self.caches.pop(guild_id, None)
+                logger.info(f"Compacted {guild_id}: {deleted} messages, {downsampled} hourly rollups")
+
+    @compact_stores_task.before_loop
+    async def before_compact_stores_task(self):
+        await self.bot.wait_until_red_ready()
+
+    @commands.Cog.listener(name="on_message")
+    async def on_message(self, message: discord.Message):
+        """Add message to the index and the last seen index."""
+        store = await self.get_store(message.guild)
+        if store is None:
+            return
+        self.last_seen.see(message.guild.id, message.author.id, to_timestamp(message.created_at))
+        store.add(MessageRecord.from_message(message))
+
+    @commands.Cog.listener(name="on_raw_message_edit")
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        """Update message length and mentions in the index, also for messages not in the bot cache."""
+        guild_id = payload.data.get('guild_id')
+        if guild_id is None:
+            return
+        record = MessageRecord.from_edit(payload)
+        if record is None:
+            return
+        store = await self.get_store(self.bot.get_guild(int(guild_id)))
+        if store is None:
+            return
+        store.edit(record)
+
+    @commands.Cog.listener(name="on_raw_message_delete")
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """Remove message from the index."""
+        if payload.guild_id is None:
+            return
+        store = await self.get_store(self.bot.get_guild(payload.guild_id))
+        if store is None:
+            return
+        store.delete(payload.message_id)
+
+    @commands.Cog.listener(name="on_raw_bulk_message_delete")
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        """Remove purged messages from the index."""
+        if payload.guild_id is None:
+            return
+        store = await self.get_store(self.bot.get_guild(payload.guild_id))
+        if store is None:
+            return
+        store.delete_many(payload.message_ids)
+
+    @commands.Cog.listener(name="on_ready")
+    async def on_ready(self):
+        """Rebuild emoji index from the new guild cache."""
+        self.emoji_index.build()
+
+    @commands.Cog.listener(name="on_guild_emojis_update")
+    async def on_guild_emojis_update(self, guild: discord.Guild, before, after):
+        self.emoji_index.set_guild(guild, after)
+
+    @commands.Cog.listener(name="on_guild_join")
+    async def on_guild_join(self, guild: discord.Guild):
+        self.emoji_index.set_guild(guild, guild.emojis)
+
+    @commands.Cog.listener(name="on_guild_remove")
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.emoji_index.remove_guild(guild)
+
+    @commands.guild_only()
+    @commands.group()
+    @checks.admin_or_permissions(manage_guild=True)
+    async def dstatsset(self, ctx: Context):
+        """Discord stats settings."""
+        pass
+
+    @dstatsset.command(name="index")
+    async def dstatsset_index(self, ctx: Context):
+        """Toggle the local message index for this server.
+
+        When enabled, metadata of messages (author, channel, time, length,
+        mentions and reply target) is stored so that stats can be answered
+        without crawling channel history again. Message content is never stored.
+        """
+        enabled = not await self.config.guild(ctx.guild).index()
+        await self.config.guild(ctx.guild).index.set(enabled)
+        self.caches.pop(ctx.guild.id, None)
+
+        if enabled:
+            await ctx.send(
+                "Message index enabled. New messages are indexed as they are posted, "
+                "and crawled history is kept so repeated stats only fetch what is new."
+            )
+        else:
+            store = self.stores.pop(ctx.guild.id, None)
+            if store is not None:
+                store.close()
+            await ctx.send("Message index disabled.")
+
+    @dstatsset.command(name="concurrency")
+    async def dstatsset_concurrency(self, ctx: Context, channels: int):
+        """Number of channels crawled at the same time."""
+        if not 1 <= channels <= MAX_CONCURRENCY:
+            await ctx.send(f"Concurrency must be between 1 and {MAX_CONCURRENCY}.")
+            return
+        await self.config.guild(ctx.guild).concurrency.set(channels)
+        await ctx.send(f"Crawling up to {channels} channels at the same time.")
+
+    @dstatsset.command(name="cachettl")
+    async def dstatsset_cache_ttl(self, ctx: Context, seconds: int):
+        """Seconds to reuse a report for identical requests. 0 disables the cache."""
+        seconds = max(0, seconds)
+        await self.config.guild(ctx.guild).cache_ttl.set(seconds)
+        self.caches.pop(ctx.guild.id, None)
+        if seconds:
+            await ctx.send(f"Reports are reused for {seconds} seconds.")
+        else:
+            await ctx.send("Report cache disabled.")
+
+    @dstatsset.command(name="import")
+    @checks.is_owner()
+    async def dstatsset_import(self, ctx: Context, *, path: str):
+        """Import DiscordChatExporter JSON exports into the message index.
+
+        path is a file or a directory on the bot host, searched recursively
+        for .json and .json.gz files. Exports of other servers are skipped.
+        Channels are covered for the date range of their export, so stats
+        over that range no longer crawl channel history.
+        """
+        store = await self.get_store(ctx.guild)
+        if store is None:
+            await ctx.send("Enable the message index first with `dstatsset index`.")
+            return
+        files = export_files(path)
+        if not files or not all(f.is_file() for f in files):
+            await ctx.send("No export files found.")
+            return
+
+        started = time.monotonic()
+        total = 0
+        failed = []
+        async with ctx.typing():
+            for f in files:
+                export = ExportFile(f)
+                try:
+                    total += await import_export(store, export, guild_id=ctx.guild.id)
+                except (OSError, KeyError, ValueError) as e:
+                    logger.warning(f"Cannot import {f}: {e}")
+                    failed.append(f.name)
+        self.caches.pop(ctx.guild.id, None)
+
+        await ctx.send(
+            "Imported {total:,} messages from {count} file(s) in {elapsed:.0f}s.".format(
+                total=total, count=len(files) - len(failed), elapsed=time.monotonic() - started
+            )
+        )
+        if failed:
+            for page in pagify("Skipped: " + ", ".join(failed)):
+                await ctx.send(page)
+
+    @dstatsset.command(name="retention")
+    async def dstatsset_retention(self, ctx: Context, days: int, hourly_days: int = 0):
+        """Days to keep messages and hourly counts in the index. 0 keeps them forever.
+
+        Older messages are deleted in the background, their counts stay in
+        hourly rollups. Hourly rollups older than hourly_days are merged into
+        daily rollups. Reports that need single messages (interactions) or
+        hours (heatmap) crawl channel history for windows past retention.
+        """
+        days = max(0, days)
+        hourly_days = max(0, hourly_days)
+        if hourly_days and (not days or hourly_days < days):
+            await ctx.send("Hourly counts must be kept at least as long as messages.")
+            return
+        guild_config = self.config.guild(ctx.guild)
+        await guild_config.retention_days.set(days)
+        await guild_config.hourly_retention_days.set(hourly_days)
+        await ctx.send(
+            "Messages are kept {messages}, hourly counts {hourly}.".format(
+                messages=f"for {days} days" if days else "forever",
+                hourly=f"for {hourly_days} days" if hourly_days else "forever",
+            )
+        )
+
+    @dstatsset.command(name="status")
+    async def dstatsset_status(self, ctx: Context):
+        """Show index status for this server."""
+        store = await self.get_store(ctx.guild)
+        if store is None:
+            await ctx.send("Message index is disabled.")
+            return
+        settings = await self.config.guild(ctx.guild).all()
+        counts = await store.read(store.table_counts)
+        await ctx.send(
+            "Message index is enabled.\n"
+            "Messages: {messages}\n"
+            "Hourly rollups: {rollups}\n"
+            "Daily rollups: {daily_rollups}\n"
+            "Covers since: {since}\n"
+            "Channel cursors: {cursors}\n"
+            "Retention: {retention}\n"
+            "Size: {size}".format(
+                since=from_timestamp(store.since).strftime('%a, %b %d, %Y, %H:%M:%S UTC'),
+                cursors=len(store.cursors),
+                retention="messages {}, hourly counts {}".format(
+                    f"{settings['retention_days']} days" if settings['retention_days'] else "forever",
+                    f"{settings['hourly_retention_days']} days" if settings['hourly_retention_days'] else "forever",
+                ),
+                size=humanize.naturalsize(store.size()),
+                **counts,
+            )
+        )
+
+    @dstatsset.command(name="storage")
+    @checks.is_owner()
+    async def dstatsset_storage(self, ctx: Context):
+        """Show disk usage of the message index of every server."""
+        rows = []
+        for path in cog_data_path(self).glob('*.sqlite3'):
+            # with the write-ahead log, which holds recent writes until a checkpoint
+            size = sum(p.stat().st_size for p in [path, path.with_name(path.name + '-wal')] if p.exists())
+            guild = self.bot.get_guild(int(path.stem)) if path.stem.isdigit() else None
+            rows.append((size, guild.name if guild else path.stem))
+        if not rows:
+            await ctx.send("No message index on disk.")
+            return
+        rows.sort(reverse=True)
+        lines = [f"{humanize.naturalsize(size):>10}  {name}" for size, name in rows]
+        lines.append(f"{humanize.naturalsize(sum(size for size, _ in rows)):>10}  Total")
+        for page in pagify("\n".join(lines)):
+            await ctx.send(box(page))
 
     @commands.group()
     async def dstats(self, ctx: Context):
         """Discord stats."""
         pass
 
+    @dstats.command(name="cancel")
+    @checks.mod_or_permissions()
+    async def dstats_cancel(self, ctx: Context):
+        """Cancel running crawls in this server.
+
+        Cancelled reports are sent with the messages fetched so far.
+        """
+        jobs = [job for job in self.jobs.get(ctx.guild.id, ()) if not job.cancelled]
+        if not jobs:
+            await ctx.send("No crawl in progress.")
+            return
+        for job in jobs:
+            job.cancel()
+        await ctx.send(f"Cancelled {len(jobs)} crawl(s).")
+
     @dstats.command(name="user")
     @checks.mod_or_permissions()
     async def dstats_user(self, ctx: Context, member: discord.Member, limit=10000, days=7):
         """User stats."""
         async with ctx.typing():
-            glog = GuildLog(ctx.guild)
-            em = await glog.user_history_embed(member, days=days, limit=limit)
+            em, note = await self.run_report(
+                ctx,
+                make_key('user', member=member.id, limit=limit, days=days),
+                lambda glog: glog.user_history_embed(member, days=days, limit=limit)
+            )
             await ctx.send(embed=em)
+            await self.send_coverage_note(ctx, note)
 
-    @dstats.command(name="mentions")
-    @checks.mod_or_permissions()
-    async def dstats_mentions(self, ctx: Context, limit=10000):
-        """Count mentions by users"""
-        guild = ctx.guild
-        mentioned = dict()
-        ch = ctx.message.channel
+    async def interaction_graph(self, ctx: Context, args):
+        """Parse interaction arguments and build the graph in one crawl.
 
-        async with ctx.typing():
-            for channel in guild.text_channels:
-                # soon will add flag allowing all vs current
-                if ch.id != channel.id:
-                    continue
-                try:
-                    async for message in channel.history(limit=limit, oldest_first=False):
-                        if not message.mentions:
-                            continue
-
-                        for member in message.mentions:
-                            if member.id not in mentioned.keys():
-                                mentioned[member.id] = dict(
-                                    member=member,
-                                    count=0
-                                )
-                            mentioned[member.id]["count"] += 1
-                except Exception as e:
-                    logger.exception(e)
-
-        mentioned = list(mentioned.values())
-        mentioned.sort(key=lambda x: x.get('count', 0), reverse=True)
+        Return (graph, description, parsed arguments, coverage note) or None if arguments are invalid.
+        """
+        p = interactions_parser()
+        try:
+            pargs = p.parse_args(args)
+        except SystemExit:
+            await ctx.send_help()
+            return None
 
-        em = discord.Embed(
-            title=guild.name,
-            description=f"Most mentioned members in {ch.mention}",
-            color=discord.Color.red()
-        )
-        em.set_footer(text=guild.name, icon_url=guild.icon_url)
+        if pargs.scope == 'channel':
+            channels = [ctx.channel]
+            where = ctx.channel.mention
+        else:
+            channels = ctx.guild.text_channels
+            where = ctx.guild.name
 
-        value = " - ".join([f"{m['member']} {m['count']}" for m in mentioned])
+        graph, note = await self.run_report(
+            ctx,
+            make_key('interactions', pargs, channel=channels[0].id if pargs.scope == 'channel' else None),
+            lambda glog: glog.interaction_graph(channels, days=pargs.days, limit=pargs.limit or None)
+        )
+        description = f"{where} in the last {pargs.days} days"
+        return graph, description, pargs, note
+
+    @staticmethod
+    def interactions_value(glog: GuildLog, items):
+        """Format (member id or pair of ids, count) items."""
+        out = []
+        for key, count in items:
+            if isinstance(key, tuple):
+                name = " ↔ ".join([str(glog.author_name(member_id)) for member_id in key])
+            else:
+                name = glog.author_name(key)
+            out.append(f"{name} {count}")
+        value = " - ".join(out) or "None"
         if len(value) > 1000:
             value = value[:1000]
+        return value
 
-        em.add_field(name="Result", value=value)
-        await ctx.send(embed=em)
-
-    @dstats.command(name="mentioning")
-    @checks.mod_or_permissions()
-    async def dstats_mentioning(self, ctx: Context, limit=10000, days=7):
-        """Count users that mention people the most."""
-        guild = ctx.guild
-        members = dict()
-        ch = ctx.message.channel
+    async def send_interactions(self, ctx: Context, args, title, fields):
+        """Send embed with fields computed from the interaction graph.
 
+        fields is a list of (name, fn) where fn(graph, top) returns (member id, count) items.
+        """
         async with ctx.typing():
-            for channel in guild.text_channels:
-                # soon will add flag allowing all vs current
-                if ch.id != channel.id:
-                    continue
-                try:
-                    after = dt.datetime.utcnow() - dt.timedelta(days=days)
-                    async for message in channel.history(limit=limit, after=after):
-                        if not message.mentions:
-                            continue
+            result = await self.interaction_graph(ctx, args)
+            if result is None:
+                return
+            graph, description, pargs, note = result
 
-                        author = message.author
+            guild = ctx.guild
+            glog = GuildLog(guild)
+            if pargs.export:
+                await self.send_export(
+                    ctx, pargs.export, f"interactions-{guild.id}", glog.interaction_graph_export(graph)
+                )
+                await self.send_coverage_note(ctx, note)
+                return
+            em = discord.Embed(
+                title=guild.name,
+                description=f"{title} in {description}",
+                color=discord.Color.red()
+            )
+            em.set_footer(text=guild.name, icon_url=guild.icon_url)
+            for name, fn in fields:
+                em.add_field(name=name, value=self.interactions_value(glog, fn(graph, pargs.top)), inline=False)
+            await ctx.send(embed=em)
+            await self.send_coverage_note(ctx, note)
 
-                        if author.id not in members.keys():
-                            members[author.id] = dict(
-                                member=author,
-                                count=0
-                            )
-                        members[author.id]["count"] += 1
+    @dstats.command(name="mentions")
+    @checks.mod_or_permissions()
+    async def dstats_mentions(self, ctx: Context, *args):
+        """Count mentions by users.
 
-                except Exception as e:
-                    logger.exception(e)
+        usage: [p]dstats mentions [-h] [-s {channel,guild}] [-n TOP] [-d DAYS] [-l LIMIT]
+                                           [-e {csv,jsonl,parquet}]
+        """
+        await self.send_interactions(ctx, args, "Most mentioned members", [
+            ("Result", lambda graph, top: graph.in_degree(MENTIONS).most_common(top)),
+        ])
 
-        mentioned = list(members.values())
-        mentioned.sort(key=lambda x: x.get('count', 0), reverse=True)
+    @dstats.command(name="mentioning")
+    @checks.mod_or_permissions()
+    async def dstats_mentioning(self, ctx: Context, *args):
+        """Count users that mention people the most.
 
+        usage: [p]dstats mentioning [-h] [-s {channel,guild}] [-n TOP] [-d DAYS] [-l LIMIT]
+                                           [-e {csv,jsonl,parquet}]
+        """
+        await self.send_interactions(ctx, args, "Members who mention others the most", [
+            ("Result", lambda graph, top: graph.out_degree(MENTIONS).most_common(top)),
+        ])
+
+    @dstats.command(name="interactions")
+    @checks.mod_or_permissions()
+    async def dstats_interactions(self, ctx: Context, *args):
+        """Mention and reply leaderboards and top pairs from one crawl.
+
+        usage: [p]dstats interactions [-h] [-s {channel,guild}] [-n TOP] [-d DAYS] [-l LIMIT]
+                                           [-e {csv,jsonl,parquet}]
+        """
+        await self.send_interactions(ctx, args, "Interactions", [
+            ("Most mentioned", lambda graph, top: graph.in_degree(MENTIONS).most_common(top)),
+            ("Most mentioning", lambda graph, top: graph.out_degree(MENTIONS).most_common(top)),
+            ("Most replied to", lambda graph, top: graph.in_degree(REPLIES).most_common(top)),
+            ("Most replying", lambda graph, top: graph.out_degree(REPLIES).most_common(top)),
+            ("Top pairs", lambda graph, top: graph.top_pairs(top)),
+        ])
+
+    def word_counts_embed(self, guild: discord.Guild, counter: WordCounter, description, top=100):
+        """Embed with the most common words of each n-gram size."""
         em = discord.Embed(
             title=guild.name,
-            description=f"Members who mention others the most in {ch.mention} in last {days} days",
+            description=description,
             color=discord.Color.red()
         )
-        em.set_footer(text=guild.name, icon_url=guild.icon_url)
+        em.set_footer(text=f"{counter.messages} messages", icon_url=guild.icon_url)
 
-        value = " - ".join([f"{m['member']} {m['count']}" for m in mentioned])
-        if len(value) > 1000:
-            value = value[:1000]
+        for n in counter.ngrams:
+            out = []
+            for word, count in counter.most_common(n, top=top):
+                m = re.match(r'^:([a-zA-Z\_]+):$', word)
+                if m:
+                    word = get_emoji(self.emoji_index, m.group(1))
+                out.append((word, count))
 
-        em.add_field(name="Result", value=value)
-        await ctx.send(embed=em)
+            name = "{}: Count".format(NGRAM_NAMES.get(n, f"{n}-gram"))
+            value = " - ".join(["{} {}".format(word, count) for word, count in out]) or "None"
+            if len(value) > 1000:
+                value = value[:1000]
+
+            em.add_field(name=name, value=value, inline=False)
+        return em
 
     @dstats.command(name="userwords")
     @checks.mod_or_permissions()
     async def dstats_user_words(self, ctx: Context, member: discord.Member, limit=10000, days=7):
         """Count word usage in channel"""
-        guild = ctx.guild
-        channel = ctx.channel
         async with ctx.typing():
-            texts = []
-            try:
-                async for message in channel.history(limit=limit, oldest_first=False):
-                    if message.author == member:
-                        texts += [word.lower() for word in message.content.split(' ') if word not in stop_words]
-            except Exception as e:
-                logger.exception(e)
+            counter, note = await self.run_report(
+                ctx,
+                make_key('userwords', channel=ctx.channel.id, member=member.id, limit=limit, days=days),
+                lambda glog: glog.word_counts([ctx.channel], member=member, days=days, limit=limit)
+            )
+            em = self.word_counts_embed(
+                ctx.guild, counter, "Words used by {}".format(member.display_name)
+            )
+            await ctx.send(embed=em)
+            await self.send_coverage_note(ctx, note)
 
-            mc = Counter(texts).most_common(100)
+    @dstats.command(name="words")
+    @checks.mod_or_permissions()
+    async def dstats_words(self, ctx: Context, *args):
+        """Count word usage in channel or server.
 
-            em = discord.Embed(
-                title=guild.name,
-                description="Words used by {}".format(member.display_name),
-                color=discord.Color.red()
-            )
-            em.set_footer(text=guild.name, icon_url=guild.icon_url)
+        usage: [p]dstats words [-h] [-s {channel,guild}] [-u USER] [-g {1,2,3} [{1,2,3} ...]]
+                               [-n TOP] [-d DAYS] [-l LIMIT] [-e {csv,jsonl,parquet}]
 
-            out = []
-            for word, count in mc:
-                m = re.match(r'^:([a-zA-Z\_]+):$', word)
-                if m:
-                    word = get_emoji(self.bot, m.group(1))
-                out.append((word, count))
+        optional arguments:
+          -s, --scope {channel,guild}   Current channel (default) or all channels
+          -u USER, --user USER          Only count words by this member
+          -g, --ngrams {1,2,3} ...      Words, bigrams and / or trigrams
+          -n TOP, --top TOP             Top N results
+          -d DAYS, --days DAYS          Last N days
+          -l LIMIT, --limit LIMIT       Limit N messages per channel
+          -e, --export {csv,jsonl,parquet}
+                                        Send all counted terms as a file
+        """
+        p = words_parser()
+        try:
+            pargs = p.parse_args(args)
+        except SystemExit:
+            await ctx.send_help()
+            return
 
-            name = "Word: Count"
-            value = " - ".join(["{} {}".format(word, count) for word, count in out])
-            if len(value) > 1000:
-                value = value[:1000]
+        member = None
+        if pargs.user is not None:
+            member = await commands.MemberConverter().convert(ctx, pargs.user)
 
-            em.add_field(name=name, value=value)
+        if pargs.scope == 'guild':
+            channels = ctx.guild.text_channels
+            description = "Words used in {}".format(ctx.guild.name)
+        else:
+            channels = [ctx.channel]
+            description = "Words used in {}".format(ctx.channel.mention)
+        if member is not None:
+            description += " by {}".format(member.display_name)
+        description += " in the last {} days".format(pargs.days)
+
+        async with ctx.typing():
+            counter, note = await self.run_report(
+                ctx,
+                make_key(
+                    'words', pargs,
+                    user=member.id if member else None,
+                    channel=ctx.channel.id if pargs.scope == 'channel' else None,
+                ),
+                lambda glog: glog.word_counts(
+                    channels, member=member, days=pargs.days, limit=pargs.limit or None, ngrams=pargs.ngrams
+                )
+            )
+            if pargs.export:
+                glog = GuildLog(ctx.guild)
+                await self.send_export(ctx, pargs.export, f"words-{ctx.guild.id}", glog.word_counts_export(counter))
+                await self.send_coverage_note(ctx, note)
+                return
+            em = self.word_counts_embed(ctx.guild, counter, description, top=pargs.top)
             await ctx.send(embed=em)
+            await self.send_coverage_note(ctx, note)
+
+    @dstats.command(name="heatmap")
+    @checks.mod_or_permissions()
+    async def dstats_heatmap(self, ctx: Context, *args):
+        """Activity by weekday and hour of day.
+
+        usage: [p]dstats heatmap [-h] [-c CHANNEL] [-r ROLE] [-u USER] [-z {-12..14}]
+                                 [-d DAYS] [-l LIMIT] [-e {csv,jsonl,parquet}]
+
+        optional arguments:
+          -c CHANNEL, --channel CHANNEL     Only count messages in this channel
+          -r ROLE, --role ROLE              Only count messages by members with this role
+          -u USER, --user USER              Only count messages by this member
+          -z, --utc-offset {-12..14}        Hours from UTC of the time zone to show
+          -d DAYS, --days DAYS              Last N days (default 28)
+          -l LIMIT, --limit LIMIT           Limit N messages per channel
+          -e, --export {csv,jsonl,parquet}  Send counts as a file instead of a table
+        """
+        p = heatmap_parser()
+        try:
+            pargs = p.parse_args(args)
+        except SystemExit:
+            await ctx.send_help()
+            return
+
+        guild = ctx.guild
+        title = guild.name
+        channels = guild.text_channels
+        if pargs.channel is not None:
+            channel = await commands.TextChannelConverter().convert(ctx, pargs.channel)
+            channels = [channel]
+            title = f"#{channel.name}"
+
+        member_ids = None
+        if pargs.role is not None:
+            roles = get_guild_roles(guild, [pargs.role])
+            if not roles:
+                await ctx.send("Cannot find role. Aborted.")
+                return
+            member_ids = set(m.id for m in roles[0].members)
+            title += f", {roles[0].name}"
+        if pargs.user is not None:
+            member = await commands.MemberConverter().convert(ctx, pargs.user)
+            member_ids = {member.id} if member_ids is None else member_ids & {member.id}
+            title += f", {member.display_name}"
+        title += f", last {pargs.days} days"
+
+        async with ctx.typing():
+            grid, note = await self.run_report(
+                ctx,
+                make_key(
+                    'heatmap', pargs,
+                    channel=channels[0].id if pargs.channel is not None else None,
+                    member_ids=member_ids,
+                ),
+                lambda glog: glog.activity_heatmap(
+                    channels, days=pargs.days, limit=pargs.limit or None,
+                    member_ids=member_ids, utc_offset=pargs.utc_offset,
+                )
+            )
+            image = await self.bot.loop.run_in_executor(
+                None, heatmap.render, grid, title, pargs.utc_offset
+            )
+            await ctx.send(file=discord.File(image, filename="heatmap.png"))
+            if pargs.export:
+                rows = (
+                    (heatmap.WEEKDAYS[weekday], hour, int(grid[weekday, hour]))
+                    for weekday in range(7) for hour in range(24)
+                )
+                await self.send_export(
+                    ctx, pargs.export, f"heatmap-{guild.id}", (['weekday', 'hour', 'messages'], rows)
+                )
+            else:
+                for page in pagify(heatmap.format_table(grid), shorten_by=24):
+                    await ctx.send(box(page))
+            await self.send_coverage_note(ctx, note)
+
+    @dstats.command(name="inactive")
+    @checks.mod_or_permissions()
+    async def dstats_inactive(self, ctx: Context, *args):
+        """Members who have not posted for N days.
+
+        Answered from the last seen index, kept from every message the bot
+        sees while the message index is enabled, without crawling channel
+        history.
+
+        usage: [p]dstats inactive [-h] [-d DAYS] [-r ROLE] [-e {csv,jsonl,parquet}]
+
+        optional arguments:
+          -d DAYS, --days DAYS              Silent for at least N days (default 30)
+          -r ROLE, --role ROLE              Only list members with this role
+          -e, --export {csv,jsonl,parquet}  Send the list as a file instead of a menu
+        """
+        p = inactive_parser()
+        try:
+            pargs = p.parse_args(args)
+        except SystemExit:
+            await ctx.send_help()
+            return
+
+        guild = ctx.guild
+        if not await self.config.guild(guild).index():
+            await ctx.send("Last seen is only tracked with the message index. Enable it with `dstatsset index`.")
+            return
+        title = guild.name
+        members = guild.members
+        if pargs.role is not None:
+            roles = get_guild_roles(guild, [pargs.role])
+            if not roles:
+                await ctx.send("Cannot find role. Aborted.")
+                return
+            members = roles[0].members
+            title += f", {roles[0].name}"
+        members = [m for m in members if not m.bot]
+
+        self.last_seen.flush()
+        results = self.last_seen.inactive(guild.id, members, pargs.days)
+
+        if pargs.export:
+            rows = (
+                (member.id, str(member), last_seen.isoformat() if last_seen else None)
+                for member, last_seen in results
+            )
+            await self.send_export(
+                ctx, pargs.export, f"inactive-{guild.id}", (['member_id', 'member', 'last_seen'], rows)
+            )
+        else:
+            now = dt.datetime.utcnow()
+            lines = [
+                "{} · {}".format(
+                    member.display_name, humanize.naturaltime(now - last_seen) if last_seen else "never"
+                )
+                for member, last_seen in results
+            ]
+            pages = list(pagify("\n".join(lines) or "None", page_length=1000))
+            embeds = []
+            for index, page in enumerate(pages, 1):
+                em = discord.Embed(
+                    title=f"{title}: {len(results):,} inactive for {pargs.days} days",
+                    description=page,
+                )
+                em.set_footer(text=f"Page {index}/{len(pages)}", icon_url=guild.icon_url)
+                embeds.append(em)
+            await menu(ctx, embeds, DEFAULT_CONTROLS)
+
+        since = self.last_seen.since(guild.id)
+        if since is None or since > dt.datetime.utcnow() - dt.timedelta(days=pargs.days):
+            await ctx.send(
+                "Messages are tracked since {}, members who have not posted since then are not listed.".format(
+                    since.strftime('%a, %b %d, %Y, %H:%M UTC') if since else "now"
+                )
+            )
 
     @dstats.command(name="role")
     @checks.mod_or_permissions()
     async def dstats_role(self, ctx: Context, role: str, limit=10000, days=7):
-        """Users by role."""
+        """Activity leaderboard of members with role."""
         async with ctx.typing():
             # search for role
             _role = None
@@ -515,89 +1684,141 @@ class DStats(commands.Cog):
                 return
 
             # find members with role
-            members = []
-            for m in ctx.guild.members:
-                if _role in m.roles:
-                    members.append(m)
+            members = _role.members
 
             if len(members) == 0:
                 await ctx.send("Cannot find member with the role. Aborted.")
                 return
 
-            # list user stats
-            for m in members:
-                glog = GuildLog(ctx.guild)
-                em = await glog.user_history_embed(m, days=days, limit=limit)
-                await ctx.send(embed=em)
+            results, note = await self.run_report(
+                ctx,
+                make_key('role', role=_role.id, limit=limit, days=days),
+                lambda glog: glog.members_history(members, days=days, limit=limit)
+            )
+            glog = GuildLog(ctx.guild)
+            embeds = glog.members_history_embeds(results, title=f"{ctx.guild.name}: {_role.name}", days=days)
+
+        await self.send_coverage_note(ctx, note)
+        await menu(ctx, embeds, DEFAULT_CONTROLS)
 
     @dstats.command(name="channel")
     @checks.mod_or_permissions()
     async def dstats_channel(self, ctx, channel: discord.TextChannel, *args):
         """Channel stats.
 
-        usage: [p]dstats [-h] [-r ROLES [ROLES ...]] [-t TOP] [-d DAYS] [-l LIMIT]
+        usage: [p]dstats [-h] [-r ROLES [ROLES ...]] [-n TOP] [-d DAYS] [-l LIMIT]
+                         [-t TEXT [TEXT ...]] [--regex] [--case-sensitive] [-a] [-e {csv,jsonl,parquet}]
 
         optional arguments:
           -h, --help            show this help message and exit
           -r ROLES [ROLES ...], --roles ROLES [ROLES ...]
                                     Include roles
-          -t TOP, --top TOP         Top N results
+          -n TOP, --top TOP         Top N results
           -d DAYS, --days DAYS      Last N days
           -l LIMIT, --limit LIMIT   Limit N messages
+          -t TEXT [TEXT ...], --text TEXT [TEXT ...]
+                                    Only count messages containing any of these terms
+          --regex                   Text terms are regular expressions
+          --case-sensitive          Match text terms case sensitively
+          -a, --approximate         Count authors in fixed memory
+          -e, --export {csv,jsonl,parquet}
+                                    Send complete results as a file
         """
         p = parser()
         try:
             pargs = p.parse_args(args)
+            text = TextFilter.from_args(pargs)
         except SystemExit:
             await ctx.send_help()
             return
+        except re.error as e:
+            await ctx.send(f"Invalid regular expression: {e}")
+            return
 
         async with ctx.typing():
-            glog = GuildLog(ctx.guild)
             days = pargs.days
             limit = pargs.limit
             if limit == 0:
                 limit = None
-            text = pargs.text
             roles = get_guild_roles(ctx.guild, pargs.roles)
-            embeds = await glog.channel_history_embeds(channel, days=days, limit=limit, roles=roles, text=text)
+            results, note = await self.run_report(
+                ctx,
+                make_key('channel', pargs, channel=channel.id),
+                lambda glog: glog.channels_history([channel], days=days, limit=limit, roles=roles, text=text),
+                approximate=pargs.approximate
+            )
+            glog = GuildLog(ctx.guild)
+            if pargs.export:
+                await self.send_export(
+                    ctx, pargs.export, f"channel-{channel.id}", glog.channels_history_export([channel], results)
+                )
+                await self.send_coverage_note(ctx, note)
+                return
+            embeds = glog.make_channels_history_embeds(
+                [channel], results, days=days, text=text, enable_char_count=False
+            )
             for em in embeds:
                 await ctx.send(embed=em)
+            await self.send_coverage_note(ctx, note)
 
     @dstats.command(name="channel_char_count")
     @checks.mod_or_permissions()
     async def dstats_channel_char_count(self, ctx: Context, channel: discord.TextChannel, *args):
         """Channel stats by character count.
-        usage: [p]dstats [-h] [-r ROLES [ROLES ...]] [-t TOP] [-d DAYS] [-l LIMIT]
+        usage: [p]dstats [-h] [-r ROLES [ROLES ...]] [-n TOP] [-d DAYS] [-l LIMIT]
+                         [-t TEXT [TEXT ...]] [--regex] [--case-sensitive] [-a] [-e {csv,jsonl,parquet}]
 
         optional arguments:
           -h, --help            show this help message and exit
           -r ROLES [ROLES ...], --roles ROLES [ROLES ...]
                                     Include roles
-          -t TOP, --top TOP         Top N results
+          -n TOP, --top TOP         Top N results
           -d DAYS, --days DAYS      Last N days
           -l LIMIT, --limit LIMIT   Limit N messages
+          -t TEXT [TEXT ...], --text TEXT [TEXT ...]
+                                    Only count messages containing any of these terms
+          --regex                   Text terms are regular expressions
+          --case-sensitive          Match text terms case sensitively
+          -a, --approximate         Count authors in fixed memory
+          -e, --export {csv,jsonl,parquet}
+                                    Send complete results as a file
         """
         p = parser()
         try:
             pargs = p.parse_args(args)
+            text = TextFilter.from_args(pargs)
         except SystemExit:
             await ctx.send_help()
             return
+        except re.error as e:
+            await ctx.send(f"Invalid regular expression: {e}")
+            return
 
         async with ctx.typing():
-            glog = GuildLog(ctx.guild)
             days = pargs.days
             limit = pargs.limit
             if limit == 0:
                 limit = None
-            text = pargs.text
             roles = get_guild_roles(ctx.guild, pargs.roles)
-            embeds = await glog.channel_history_embeds(
-                channel, days=days, limit=limit, roles=roles, text=text, enable_char_count=True
+            results, note = await self.run_report(
+                ctx,
+                make_key('channel', pargs, channel=channel.id),
+                lambda glog: glog.channels_history([channel], days=days, limit=limit, roles=roles, text=text),
+                approximate=pargs.approximate
+            )
+            glog = GuildLog(ctx.guild)
+            if pargs.export:
+                await self.send_export(
+                    ctx, pargs.export, f"channel-{channel.id}", glog.channels_history_export([channel], results)
+                )
+                await self.send_coverage_note(ctx, note)
+                return
+            embeds = glog.make_channels_history_embeds(
+                [channel], results, days=days, text=text, enable_char_count=True
             )
             for em in embeds:
                 await ctx.send(embed=em)
+            await self.send_coverage_note(ctx, note)
 
     @dstats.command(name="channels")
     @checks.mod_or_permissions()
@@ -607,40 +1828,80 @@ class DStats(commands.Cog):
         p = parser()
         try:
             pargs = p.parse_args(args)
+            text = TextFilter.from_args(pargs)
         except SystemExit:
             await ctx.send_help()
             return
+        except re.error as e:
+            await ctx.send(f"Invalid regular expression: {e}")
+            return
 
         async with ctx.typing():
-            glog = GuildLog(ctx.guild)
             days = pargs.days
-            limit = pargs.limit
-            text = pargs.text
+            limit = pargs.limit or None
             roles = get_guild_roles(ctx.guild, pargs.roles)
             channels = sorted(ctx.guild.text_channels, key=lambda x: x.position)
 
-            for channel in channels:
-                embeds = await glog.channel_history_embeds(channel, days=days, limit=limit, roles=roles, text=text)
-                for em in embeds:
-                    await ctx.send(embed=em)
+            results, note = await self.run_report(
+                ctx,
+                make_key('channels', pargs),
+                lambda glog: glog.channels_history(channels, days=days, limit=limit, roles=roles, text=text),
+                approximate=pargs.approximate
+            )
+            glog = GuildLog(ctx.guild)
+            if pargs.export:
+                await self.send_export(
+                    ctx, pargs.export, f"channels-{ctx.guild.id}", glog.channels_history_export(channels, results)
+                )
+                await self.send_coverage_note(ctx, note)
+                return
+            embeds = glog.make_channels_history_embeds(channels, results, days=days, text=text)
+            for em in embeds:
+                await ctx.send(embed=em)
+            await self.send_coverage_note(ctx, note)
 
     @dstats.command(name="server")
     @checks.mod_or_permissions()
     async def dstats_server(self, ctx: Context, *args):
-        """Server stats by user."""
+        """Server stats by channel."""
+        p = parser()
+        try:
+            pargs = p.parse_args(args)
+            text = TextFilter.from_args(pargs)
+        except SystemExit:
+            await ctx.send_help()
+            return
+        except re.error as e:
+            await ctx.send(f"Invalid regular expression: {e}")
+            return
+
         async with ctx.typing():
-            glog = GuildLog(ctx.guild)
-            f = await glog.server_history()
+            f, note = await self.run_report(
+                ctx,
+                make_key('server', pargs),
+                lambda glog: glog.server_history(days=pargs.days, limit=pargs.limit or None, text=text),
+                approximate=pargs.approximate
+            )
+            if pargs.export:
+                await self.send_export(
+                    ctx, pargs.export, f"server-{ctx.guild.id}", GuildLog(ctx.guild).server_history_export(f)
+                )
+                await self.send_coverage_note(ctx, note)
+                return
             o = []
 
-            for channel_id, count in f.get('channels', {}).items():
-                msg = (
+            channels = sorted(f.get('channels', {}).items(), key=lambda item: item[1], reverse=True)
+            for channel_id, count in channels:
+                o.append(
                     "{channel}: {count}".format(
                         channel=ctx.guild.get_channel(channel_id),
                         count=count
                     )
                 )
-                await ctx.send(msg)
+
+        for page in pagify("\n".join(o)):
+            await ctx.send(page)
+        await self.send_coverage_note(ctx, note)
 
     @dstats.command(name="users")
     @checks.mod_or_permissions()
@@ -649,17 +1910,30 @@ class DStats(commands.Cog):
         p = parser()
         try:
             pargs = p.parse_args(args)
+            text = TextFilter.from_args(pargs)
         except SystemExit:
             await ctx.send_help()
             return
+        except re.error as e:
+            await ctx.send(f"Invalid regular expression: {e}")
+            return
 
         guild = ctx.guild
 
         async with ctx.typing():
-            glog = GuildLog(guild)
             days = pargs.days
-            text = pargs.text
-            items = await glog.users_history(days=days, text=text)
+            items, note = await self.run_report(
+                ctx,
+                make_key('users', pargs),
+                lambda glog: glog.users_history(days=days, limit=pargs.limit or None, text=text),
+                approximate=pargs.approximate
+            )
+            if pargs.export:
+                await self.send_export(
+                    ctx, pargs.export, f"users-{guild.id}", GuildLog(guild).users_history_export(items)
+                )
+                await self.send_coverage_note(ctx, note)
+                return
 
             desc = "User activity in the last {} days".format(days)
             if text is not None and len(text) > 0:
@@ -688,3 +1962,4 @@ class DStats(commands.Cog):
 
             em.add_field(name=name, value=value)
             await ctx.send(embed=em)
+            await self.send_coverage_note(ctx, note)
@@ -0,0 +1,84 @@
+import csv
+import gzip
+import io
+import json
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_FORMATS = ['csv', 'jsonl', 'parquet']
+
+# Rows per parquet row group
+PARQUET_BATCH_SIZE = 10000
+
+
+def write_csv(fp, columns, rows):
+    with gzip.GzipFile(fileobj=fp, mode='wb') as gz:
+        text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+        text.flush()
+        text.detach()
+
+
+def write_jsonl(fp, columns, rows):
+    with gzip.GzipFile(fileobj=fp, mode='wb') as gz:
+        for row in rows:
+            gz.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False).encode('utf-8'))
+            gz.write(b'\n')
+
+
+def write_parquet(fp, columns, rows):
+    # ParquetWriter closes the file it is given, so write to an arrow buffer
+    sink = pyarrow.BufferOutputStream()
+    writer = None
+    batch = []
+
+    def write_batch():
+        nonlocal writer
+        table = pyarrow.Table.from_pylist([dict(zip(columns, row)) for row in batch])
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema, compression='zstd')
+        writer.write_table(table)
+        batch.clear()
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= PARQUET_BATCH_SIZE:
+            write_batch()
+    if batch or writer is None:
+        write_batch()
+    writer.close()
+    fp.write(sink.getvalue())
+
+
+WRITERS = {
+    'csv': (write_csv, 'csv.gz'),
+    'jsonl': (write_jsonl, 'jsonl.gz'),
+    'parquet': (write_parquet, 'parquet'),
+}
+
+
+def available(fmt):
+    """True if the export format can be written with installed packages."""
+    if fmt == 'parquet':
+        return pyarrow is not None
+    return fmt in WRITERS
+
+
+def export(rows, columns, fmt, name):
+    """Stream row tuples into a compressed in-memory file.
+
+    rows can be a generator, rows are encoded one at a time as they are
+    produced. Return (file object at position 0, filename).
+    """
+    write, extension = WRITERS[fmt]
+    fp = io.BytesIO()
+    write(fp, columns, rows)
+    fp.seek(0)
+    return fp, f"{name}.{extension}"
@@ -0,0 +1,63 @@
+from collections import Counter
+from collections import defaultdict
+
+MENTIONS = 'mentions'
+REPLIES = 'replies'
+KINDS = (MENTIONS, REPLIES)
+
+
+class InteractionGraph:
+    """Sparse directed graph of who mentions or replies to whom.
+
+    Edges are kept per kind as source id -> Counter of target ids. Self
+    mentions and replies to oneself are ignored.
+    """
+
+    def __init__(self):
+        self.edges = {kind: defaultdict(Counter) for kind in KINDS}
+        self.messages = 0
+
+    def add(self, source_id, target_id, kind=MENTIONS, count=1):
+        if source_id == target_id or target_id is None:
+            return
+        self.edges[kind][source_id][target_id] += count
+
+    def add_message(self, author_id, mention_ids, reply_author_id=None):
+        self.messages += 1
+        for target_id in set(mention_ids):
+            self.add(author_id, target_id, MENTIONS)
+        self.add(author_id, reply_author_id, REPLIES)
+
+    def merge(self, other: 'InteractionGraph'):
+        self.messages += other.messages
+        for kind in KINDS:
+            for source_id, targets in other.edges[kind].items():
+                self.edges[kind][source_id].update(targets)
+
+    def kinds(self, kind=None):
+        return KINDS if kind is None else (kind,)
+
+    def in_degree(self, kind=None) -> Counter:
+        """Interactions received by member id."""
+        degree = Counter()
+        for k in self.kinds(kind):
+            for targets in self.edges[k].values():
+                degree.update(targets)
+        return degree
+
+    def out_degree(self, kind=None) -> Counter:
+        """Interactions made by member id."""
+        degree = Counter()
+        for k in self.kinds(kind):
+            for source_id, targets in self.edges[k].items():
+                degree[source_id] += sum(targets.values())
+        return degree
+
+    def top_pairs(self, n=10, kind=None):
+        """Most interacting pairs in both directions as list of ((id, id), count)."""
+        pairs = Counter()
+        for k in self.kinds(kind):
+            for source_id, targets in self.edges[k].items():
+                for target_id, count in targets.items():
+                    pairs[tuple(sorted((source_id, target_id)))] += count
+        return pairs.most_common(n)
@@ -0,0 +1,52 @@
+import io
+
+import numpy as np
+from matplotlib.figure import Figure
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+# 1970-01-01 was a Thursday
+EPOCH_WEEKDAY = 3
+
+
+def histogram(times, weights=None, utc_offset=0):
+    """7 × 24 message counts by weekday (Monday first) and hour of day.
+
+    times is a datetime64 array in UTC, weights an optional count per time,
+    utc_offset whole hours added before binning.
+    """
+    times = times.astype('datetime64[h]') + np.timedelta64(utc_offset, 'h')
+    days = times.astype('datetime64[D]')
+    hours = (times - days).astype(np.int64)
+    weekdays = (days.astype(np.int64) + EPOCH_WEEKDAY) % 7
+    grid = np.bincount(weekdays * 24 + hours, weights=weights, minlength=7 * 24)
+    return grid.reshape(7, 24).astype(np.int64)
+
+
+def format_table(grid):
+    """Fixed width table of counts, weekdays by hours."""
+    width = max(2, len(str(grid.max()))) + 1
+    lines = ["   " + "".join(f"{hour:>{width}}" for hour in range(24))]
+    for weekday, row in zip(WEEKDAYS, grid):
+        lines.append(weekday + "".join(f"{count:>{width}}" for count in row))
+    return "\n".join(lines)
+
+
+def render(grid, title, utc_offset=0):
+    """PNG image of the heatmap as a file object at position 0."""
+    fig = Figure(figsize=(12, 4), dpi=100)
+    ax = fig.add_subplot(1, 1, 1)
+    im = ax.imshow(grid, aspect='auto', cmap='YlOrRd', interpolation='nearest')
+    ax.set_title(title)
+    ax.set_yticks(range(7))
+    ax.set_yticklabels(WEEKDAYS)
+    ax.set_xticks(range(24))
+    ax.set_xticklabels([f"{hour:02d}" for hour in range(24)])
+    ax.set_xlabel("Hour (UTC{:+d})".format(utc_offset) if utc_offset else "Hour (UTC)")
+    fig.colorbar(im, ax=ax, label="Messages")
+    fig.tight_layout()
+
+    fp = io.BytesIO()
+    fig.savefig(fp, format='png')
+    fp.seek(0)
+    return fp
@@ -0,0 +1,217 @@
+import asyncio
+import datetime as dt
+import gzip
+import json
+import re
+from pathlib import Path
+
+import discord
+
+from .store import MessageRecord
+from .store import MessageStore
+from .store import snowflake_timestamp
+
+# Characters read from an export at a time
+CHUNK_SIZE = 1 << 20
+
+# Messages inserted per transaction
+IMPORT_BATCH_SIZE = 20000
+
+WHITESPACE = re.compile(r'[ \t\n\r,]*')
+
+
+def timestamp_snowflake(timestamp: float) -> int:
+    """Highest Discord id created at or before a unix timestamp."""
+    return discord.utils.time_snowflake(dt.datetime.utcfromtimestamp(timestamp), high=True)
+
+
+def parse_timestamp(value):
+    """Unix time of an ISO 8601 export timestamp, None if not set."""
+    if not value:
+        return None
+    value = value.replace('Z', '+00:00')
+    # fromisoformat only takes 3 or 6 fraction digits before Python 3.11
+    value = re.sub(r'(\.\d{6})\d+', r'\1', value)
+    t = dt.datetime.fromisoformat(value)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=dt.timezone.utc)
+    return t.timestamp()
+
+
+class JSONStream:
+    """Incremental reader of one large JSON object from a text file.
+
+    Only a chunk of the file and the value being decoded are in memory, so
+    arrays of millions of objects are read one element at a time.
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read the next chunk, return False at the end of the file."""
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next character after whitespace and commas, '' at the end of the file."""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at character {self.pos} of chunk")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """Yield (key, stream) for each key of an object.
+
+        The caller must consume the value: read it with value() or iterate
+        array(), before asking for the next key.
+        """
+        self.expect('{')
+        while self.peek() != '}':
+            key = self.value()
+            self.expect(':')
+            yield key, self
+        self.pos += 1
+
+    def array(self):
+        """Yield the elements of an array one at a time."""
+        self.expect('[')
+        while self.peek() != ']':
+            yield self.value()
+        self.pos += 1
+
+
+class ExportFile:
+    """Channel export in the JSON format of DiscordChatExporter."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.guild_id = None
+        self.channel_id = None
+        self.channel_name = None
+        self.after = None
+        self.before = None
+        self.count = 0
+        self.first_id = None
+        self.last_id = None
+
+    def open(self):
+        if self.path.suffix == '.gz':
+            return gzip.open(self.path, 'rt', encoding='utf-8')
+        return open(self.path, encoding='utf-8')
+
+    def records(self):
+        """Yield MessageRecord of every message, reading the header on the way."""
+        with self.open() as fp:
+            stream = JSONStream(fp)
+            for key, value in stream.items():
+                if key == 'messages':
+                    if self.channel_id is None:
+                        raise ValueError(f"{self.path.name}: channel must come before messages")
+                    for message in value.array():
+                        yield self.record(message)
+                    continue
+                value = value.value()
+                if key == 'guild':
+                    self.guild_id = int(value['id'])
+                elif key == 'channel':
+                    self.channel_id = int(value['id'])
+                    self.channel_name = value.get('name')
+                elif key == 'dateRange':
+                    self.after = parse_timestamp(value.get('after'))
+                    self.before = parse_timestamp(value.get('before'))
+
+    def record(self, message):
+        message_id = int(message['id'])
+        if self.first_id is None:
+            self.first_id = message_id
+        self.last_id = message_id
+        self.count += 1
+        reference = message.get('reference') or {}
+        reply_to = reference.get('messageId')
+        return MessageRecord(
+            id=message_id,
+            channel_id=self.channel_id,
+            author_id=int(message['author']['id']),
+            created_at=snowflake_timestamp(message_id),
+            length=len(message.get('content') or ''),
+            reply_to=int(reply_to) if reply_to else None,
+            mentions=tuple(int(m['id']) for m in message.get('mentions') or []),
+        )
+
+    def coverage(self):
+        """(oldest, newest_id) of the window the export is complete for.
+
+        Exports without a start date contain the channel from its first message.
+        """
+        oldest = self.after if self.after is not None else 0.0
+        if self.before is not None:
+            newest_id = timestamp_snowflake(self.before)
+        else:
+            newest_id = self.last_id
+        return oldest, newest_id
+
+
+def export_files(path):
+    """JSON export files at path, a file or a directory searched recursively."""
+    path = Path(path)
+    if path.is_dir():
+        return sorted(p for p in path.rglob('*') if p.name.endswith(('.json', '.json.gz')))
+    return [path]
+
+
+async def import_export(store: MessageStore, export: ExportFile, guild_id=None, batch_size=IMPORT_BATCH_SIZE):
+    """Insert the messages of an export into store in large transactions.
+
+    The event loop gets control back after each batch. Raise ValueError if
+    the export belongs to another guild. Return the number of messages read.
+    """
+    batch = []
+    for record in export.records():
+        if guild_id is not None and export.guild_id != guild_id:
+            raise ValueError(f"{export.path.name} is an export of another server")
+        batch.append(record)
+        if len(batch) >= batch_size:
+            store.add_many(batch)
+            batch = []
+            await asyncio.sleep(0)
+    store.add_many(batch)
+    if export.count:
+        oldest, newest_id = export.coverage()
+        store.extend_cursor(export.channel_id, oldest, newest_id)
+    return export.count
@@ -0,0 +1,118 @@
+import datetime as dt
+import sqlite3
+import time
+
+from .store import from_timestamp
+from .store import to_timestamp
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS last_seen (
+    guild_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    seen REAL NOT NULL,
+    PRIMARY KEY (guild_id, member_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tracking (
+    guild_id INTEGER PRIMARY KEY,
+    since REAL NOT NULL
+);
+"""
+
+
+class LastSeenIndex:
+    """Time of the last message of every member, for the guilds with the message index.
+
+    Lookups are served from memory. Messages only update the in-memory map
+    and a set of dirty entries, which flush() writes in one transaction, so
+    a busy channel costs one upsert per member per flush instead of one
+    write per message.
+
+    A guild is tracked since its first update. Members without an entry have
+    not posted since then, as far as the index knows.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.guilds = dict()
+        for guild_id, member_id, seen in self.conn.execute("SELECT * FROM last_seen"):
+            self.guilds.setdefault(guild_id, dict())[member_id] = seen
+        self.tracking = dict(self.conn.execute("SELECT * FROM tracking"))
+        self.dirty = set()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def see(self, guild_id: int, member_id: int, seen: float):
+        """Record a message by member at unix time seen, if later than the last one."""
+        if guild_id not in self.tracking:
+            self.tracking[guild_id] = time.time()
+            self.dirty.add((guild_id, None))
+        members = self.guilds.setdefault(guild_id, dict())
+        if seen > members.get(member_id, 0.0):
+            members[member_id] = seen
+            self.dirty.add((guild_id, member_id))
+
+    def update(self, guild_id: int, last_seen):
+        """Merge {member id: datetime} found by a crawl or in the message index."""
+        for member_id, seen in last_seen.items():
+            if seen is not None:
+                self.see(guild_id, member_id, to_timestamp(seen))
+
+    def flush(self):
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO tracking VALUES (?, ?)",
+                [(guild_id, self.tracking[guild_id]) for guild_id, member_id in dirty if member_id is None]
+            )
+            self.conn.executemany(
+                "INSERT INTO last_seen VALUES (?, ?, ?) "
+                "ON CONFLICT (guild_id, member_id) DO UPDATE SET seen = MAX(seen, excluded.seen)",
+                [
+                    (guild_id, member_id, self.guilds[guild_id][member_id])
+                    for guild_id, member_id in dirty if member_id is not None
+                ]
+            )
+
+    def get(self, guild_id: int, member_id: int):
+        """Datetime of the last message by member, None if not seen."""
+        seen = self.guilds.get(guild_id, dict()).get(member_id)
+        return from_timestamp(seen) if seen is not None else None
+
+    def since(self, guild_id: int):
+        """Datetime the guild is tracked since, None if not tracked."""
+        since = self.tracking.get(guild_id)
+        return from_timestamp(since) if since is not None else None
+
+    def inactive(self, guild_id: int, members, days: int):
+        """Members who have not posted in the last days, with the datetime of their last message.
+
+        Members who joined within the window are left out. Members never seen
+        are only listed when the guild has been tracked for the whole window,
+        otherwise they may have posted before tracking started.
+        Return list of (member, last seen datetime or None), longest silent first.
+        """
+        cutoff = dt.datetime.utcnow() - dt.timedelta(days=days)
+        cutoff_ts = to_timestamp(cutoff)
+        seen = self.guilds.get(guild_id, dict())
+        since = self.tracking.get(guild_id)
+        known = since is not None and since <= cutoff_ts
+        out = []
+        for member in members:
+            if member.joined_at is not None and member.joined_at > cutoff:
+                continue
+            last = seen.get(member.id)
+            if last is None:
+                if known:
+                    out.append((member, None))
+            elif last < cutoff_ts:
+                out.append((member, last))
+        out.sort(key=lambda item: item[1] or 0.0)
+        return [(member, from_timestamp(last) if last is not None else None) for member, last in out]
@@ -0,0 +1,189 @@
+import hashlib
+import heapq
+import math
+
+
+class SpaceSaving:
+    """Approximate top-k counter in fixed memory (Metwally et al. Space-Saving).
+
+    At most `capacity` items are tracked. When a new item arrives and the
+    counter is full, the item with the lowest count is replaced and the new
+    item inherits its count as error. Reported counts overestimate the true
+    counts by at most `error(item)`, which is never more than total / capacity.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = dict()
+        self.errors = dict()
+        self.heap = []
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _pop_min(self):
+        """Remove and return (count, item) with the lowest count."""
+        while True:
+            count, item = heapq.heappop(self.heap)
+            actual = self.counts[item]
+            if actual == count:
+                return count, item
+            # counts only grow, so refresh the stale entry and look again
+            heapq.heappush(self.heap, (actual, item))
+
+    def add(self, item, count=1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            error, victim = self._pop_min()
+            del self.counts[victim]
+            del self.errors[victim]
+        self.counts[item] = error + count
+        self.errors[item] = error
+        heapq.heappush(self.heap, (error + count, item))
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def error(self, item):
+        return self.errors.get(item, 0)
+
+    def most_common(self, n=None):
+        """List of (item, count) sorted by count."""
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        if n is not None:
+            items = items[:n]
+        return items
+
+    def merge(self, other: 'SpaceSaving'):
+        """Add the counts of another SpaceSaving, keeping their errors."""
+        for item, count in other.counts.items():
+            self.add(item, count)
+            if item in self.errors:
+                self.errors[item] += other.errors[item]
+
+
+MASK64 = (1 << 64) - 1
+
+
+def hash64(item):
+    """64 bit hash which is stable across processes (unlike hash() of str)."""
+    if isinstance(item, int):
+        # splitmix64 finalizer
+        x = (item + 0x9E3779B97F4A7C15) & MASK64
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+        return x ^ (x >> 31)
+    digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class HyperLogLog:
+    """Approximate count of distinct items in 2 ** precision bytes (Flajolet et al.).
+
+    The relative standard error of count() is 1.04 / sqrt(2 ** precision),
+    1.6% with the default precision. Sketches with the same precision are
+    merged by taking the maximum of each register.
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, item):
+        x = hash64(item)
+        index = x >> (64 - self.precision)
+        bits = 64 - self.precision
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    @property
+    def error(self):
+        """Relative standard error of count()."""
+        return 1.04 / math.sqrt(self.m)
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            return round(m * math.log(m / zeros))
+        return round(estimate)
+
+
+class ApproximateCounter:
+    """Fixed memory stand-in for collections.Counter in approximate reports.
+
+    Counts of the `capacity` most frequent items are kept by SpaceSaving and
+    the number of distinct items is estimated by HyperLogLog. Supports the
+    read-only part of the Counter interface used by reports, and update()
+    with another ApproximateCounter, a mapping or an iterable of items.
+    """
+
+    def __init__(self, capacity=1000, precision=12):
+        self.top = SpaceSaving(capacity=capacity)
+        self.distinct = HyperLogLog(precision=precision)
+
+    def add(self, item, count=1):
+        self.top.add(item, count)
+        self.distinct.add(item)
+
+    def update(self, other):
+        if isinstance(other, ApproximateCounter):
+            self.top.merge(other.top)
+            self.distinct.merge(other.distinct)
+        elif hasattr(other, 'items'):
+            for item, count in other.items():
+                self.add(item, count)
+        else:
+            for item in other:
+                self.add(item)
+
+    def __len__(self):
+        """Estimated number of distinct items, exact until the counter is full."""
+        if len(self.top) < self.top.capacity:
+            return len(self.top)
+        return max(len(self.top), self.distinct.count())
+
+    def __getitem__(self, item):
+        return self.top.counts.get(item, 0)
+
+    def __iter__(self):
+        return iter(self.top.counts)
+
+    def get(self, item, default=None):
+        return self.top.counts.get(item, default)
+
+    def keys(self):
+        return self.top.counts.keys()
+
+    def values(self):
+        return self.top.counts.values()
+
+    def items(self):
+        return self.top.counts.items()
+
+    def most_common(self, n=None):
+        return self.top.most_common(n)
+
+    @property
+    def total(self):
+        return self.top.total
+
+    def error_bound(self):
+        """Largest overestimate of any reported count."""
+        return max(self.top.errors.values(), default=0)
@@ -127,3 +127,5 @@ stop_words = ["a", "about", "above", "after", "again", "against", "ain", "all",
               "ue", "ui", "uj", "uk", "um", "un", "uo", "ur", "ut", "va", "wa", "vd", "wi", "vj", "vo", "wo", "vq",
               "vt", "vu", "x1", "x2", "x3", "xf", "xi", "xj", "xk", "xl", "xn", "xo", "xs", "xt", "xv", "xx", "y2",
               "yj", "yl", "yr", "ys", "yt", "zi", "zz"]
+
+STOP_WORDS = frozenset(stop_words)
@@ -0,0 +1,581 @@
+import asyncio
+import datetime as dt
+import functools
+import math
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+import discord
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    length INTEGER NOT NULL,
+    reply_to INTEGER
+);
+CREATE INDEX IF NOT EXISTS messages_created_at ON messages (created_at);
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel_id, created_at);
+CREATE INDEX IF NOT EXISTS messages_author ON messages (author_id, created_at);
+CREATE TABLE IF NOT EXISTS mentions (
+    message_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    PRIMARY KEY (message_id, member_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cursors (
+    channel_id INTEGER PRIMARY KEY,
+    oldest REAL NOT NULL,
+    newest_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    hour INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    chars INTEGER NOT NULL DEFAULT 0,
+    mentions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, channel_id, author_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollups_author ON rollups (author_id, hour);
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    day INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    chars INTEGER NOT NULL DEFAULT 0,
+    mentions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, channel_id, author_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TRIGGER IF NOT EXISTS rollups_messages AFTER INSERT ON messages BEGIN
+    INSERT INTO rollups (hour, channel_id, author_id, messages, chars)
+    VALUES (CAST(NEW.created_at / 3600 AS INTEGER), NEW.channel_id, NEW.author_id, 1, NEW.length)
+    ON CONFLICT (hour, channel_id, author_id) DO UPDATE SET
+        messages = messages + 1, chars = chars + excluded.chars;
+END;
+CREATE TRIGGER IF NOT EXISTS rollups_mentions AFTER INSERT ON mentions BEGIN
+    UPDATE rollups SET mentions = mentions + 1
+    WHERE (hour, channel_id, author_id) = (
+        SELECT CAST(created_at / 3600 AS INTEGER), channel_id, author_id FROM messages WHERE id = NEW.message_id
+    );
+END;
+"""
+
+# Rollups of messages indexed before the rollups table existed
+MIGRATE_ROLLUPS = """
+INSERT OR IGNORE INTO rollups
+SELECT CAST(created_at / 3600 AS INTEGER), channel_id, author_id, COUNT(*), SUM(length),
+       SUM((SELECT COUNT(*) FROM mentions WHERE message_id = id))
+FROM messages GROUP BY 1, 2, 3
+"""
+
+SCHEMA_VERSION = 1
+
+# Number of buffered messages which forces a flush before the periodic task runs
+FLUSH_SIZE = 500
+
+# Messages deleted per transaction by compaction
+COMPACT_CHUNK_SIZE = 5000
+
+# Days of hourly rollups downsampled per transaction by compaction
+DOWNSAMPLE_CHUNK_DAYS = 7
+
+# Resolutions of stored statistics, from raw messages to daily rollups
+MESSAGE = 'message'
+HOUR = 'hour'
+DAY = 'day'
+
+
+def to_timestamp(value: dt.datetime) -> float:
+    """Convert naive UTC datetime used by discord.py to a unix timestamp."""
+    return value.replace(tzinfo=dt.timezone.utc).timestamp()
+
+
+def from_timestamp(value: float) -> dt.datetime:
+    """Convert unix timestamp to naive UTC datetime used by discord.py."""
+    return dt.datetime.utcfromtimestamp(value)
+
+
+def snowflake_timestamp(snowflake: int) -> float:
+    """Unix timestamp of a Discord id."""
+    return ((snowflake >> 22) + discord.utils.DISCORD_EPOCH) / 1000
+
+
+class MessageRecord(NamedTuple):
+    """Message metadata kept by the store. Content is never stored."""
+    id: int
+    channel_id: int
+    author_id: int
+    created_at: float
+    length: int
+    reply_to: Optional[int]
+    mentions: Tuple[int, ...]
+
+    @classmethod
+    def from_message(cls, message: discord.Message):
+        reference = message.reference
+        return cls(
+            id=message.id,
+            channel_id=message.channel.id,
+            author_id=message.author.id,
+            created_at=to_timestamp(message.created_at),
+            length=len(message.content),
+            reply_to=reference.message_id if reference is not None else None,
+            mentions=tuple(m.id for m in message.mentions),
+        )
+
+    @classmethod
+    def from_edit(cls, payload: discord.RawMessageUpdateEvent):
+        """Record of the edited message, None if the edit did not change the content."""
+        data = payload.data
+        if 'content' not in data:
+            return None
+        reference = data.get('message_reference') or {}
+        return cls(
+            id=payload.message_id,
+            channel_id=payload.channel_id,
+            author_id=int(data.get('author', {}).get('id', 0)),
+            created_at=snowflake_timestamp(payload.message_id),
+            length=len(data['content']),
+            reply_to=int(reference['message_id']) if 'message_id' in reference else None,
+            mentions=tuple(int(m['id']) for m in data.get('mentions', [])),
+        )
+
+
+class MessageStore:
+    """Per-guild SQLite index of message metadata.
+
+    Writes are buffered and committed in one transaction by flush(), which
+    runs periodically and before every query.
+
+    Queries over the whole window (sum_window, last_seen, channel_last_seen,
+    interactions, hourly_counts and table_counts) read through a second
+    connection in a worker thread, so a large index does not block the event
+    loop. Run them with `await store.read(...)`, which flushes first.
+
+    Every channel is covered since the store was opened, by the listener.
+    Older windows are covered per channel by a cursor: every message in the
+    channel created after `oldest` and up to `newest_id` is in the store.
+    Cursors are live once they have been synced in this session, after which
+    the listener keeps moving `newest_id` forward.
+
+    Hourly rollups of message, character and mention counts by channel and
+    author are kept by triggers on insert, so counts over long windows are
+    sums over buckets instead of scans over messages.
+
+    With retention, compact() deletes messages older than `compacted_before`
+    and downsamples hourly rollups older than `hourly_before` into daily
+    rollups. Counts keep working over any window, at day resolution for the
+    downsampled part. Messages older than `compacted_before` are not
+    inserted again, since they may already be counted in the rollups.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.migrate()
+        self.pending = []
+        self.since = time.time()
+        self.cursors = {
+            channel_id: [oldest, newest_id]
+            for channel_id, oldest, newest_id in self.conn.execute("SELECT * FROM cursors")
+        }
+        self.live = set()
+        self.dirty = set()
+        self.compacted_before = self.get_meta('compacted_before', 0.0)
+        self.hourly_before = self.get_meta('hourly_before', 0.0)
+        # one worker, so the reader connection is only used by one thread at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.reader = None
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def retains(self, after: dt.datetime, resolution=DAY) -> bool:
+        """True if statistics of resolution are kept for the window since after."""
+        after_ts = to_timestamp(after) if after is not None else 0.0
+        if resolution == MESSAGE:
+            return after_ts >= self.compacted_before
+        if resolution == HOUR:
+            return after_ts >= self.hourly_before
+        return True
+
+    def migrate(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        with self.conn:
+            if version < 1:
+                self.conn.execute(MIGRATE_ROLLUPS)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown(wait=True)
+        if self.reader is not None:
+            self.reader.close()
+        self.conn.close()
+
+    def read_conn(self):
+        """Connection of the worker thread. With the write-ahead log, reads do not block writes."""
+        if self.reader is None:
+            self.reader = sqlite3.connect(self.path, check_same_thread=False)
+        return self.reader
+
+    async def read(self, fn, *args, **kwargs):
+        """Flush buffered writes, then run fn(*args, **kwargs) in the worker thread."""
+        self.flush()
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def covers(self, after: dt.datetime) -> bool:
+        """True if every message after this time is in the store."""
+        return after is not None and to_timestamp(after) >= self.since
+
+    def covers_channel(self, channel_id: int, after: dt.datetime) -> bool:
+        """True if every message in channel after this time is in the store."""
+        if self.covers(after):
+            return True
+        cursor = self.cursors.get(channel_id)
+        # nothing older than compacted_before is added again, the rollups are all there is
+        return (
+            after is not None and cursor is not None and channel_id in self.live
+            and cursor[0] <= max(to_timestamp(after), self.compacted_before)
+        )
+
+    def cursor(self, channel_id: int):
+        """(oldest, newest_id) of channel cursor or None."""
+        cursor = self.cursors.get(channel_id)
+        if cursor is None:
+            return None
+        return tuple(cursor)
+
+    def set_cursor(self, channel_id: int, oldest: float, newest_id: Optional[int]):
+        """Save channel cursor after a sync and mark it live."""
+        self.cursors[channel_id] = [oldest, newest_id]
+        self.live.add(channel_id)
+        self.dirty.add(channel_id)
+        self.flush()
+
+    def extend_cursor(self, channel_id: int, oldest: float, newest_id: int):
+        """Merge a complete window of imported messages into the channel cursor.
+
+        The cursor only grows when the window overlaps it, otherwise the gap
+        between them would be reported as covered.
+        """
+        if snowflake_timestamp(newest_id) < self.compacted_before:
+            return
+        # older messages are not inserted
+        oldest = max(oldest, self.compacted_before)
+        cursor = self.cursors.get(channel_id)
+        if cursor is None:
+            self.cursors[channel_id] = [oldest, newest_id]
+        else:
+            cursor_oldest, cursor_newest_id = cursor
+            if oldest < cursor_oldest <= snowflake_timestamp(newest_id):
+                cursor[0] = oldest
+            if (
+                    channel_id not in self.live and cursor_newest_id is not None
+                    and oldest <= snowflake_timestamp(cursor_newest_id) and newest_id > cursor_newest_id
+            ):
+                cursor[1] = newest_id
+        self.dirty.add(channel_id)
+        self.flush()
+
+    def size(self) -> int:
+        """Size on disk in bytes."""
+        total = 0
+        for suffix in ['', '-wal']:
+            try:
+                total += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return total
+
+    def add(self, record: MessageRecord):
+        self.pending.append(record)
+        if record.channel_id in self.live:
+            cursor = self.cursors[record.channel_id]
+            if cursor[1] is None or record.id > cursor[1]:
+                cursor[1] = record.id
+                self.dirty.add(record.channel_id)
+        if len(self.pending) >= FLUSH_SIZE:
+            self.flush()
+
+    def add_many(self, records):
+        """Insert records in one transaction, without moving cursors."""
+        self.flush()
+        with self.conn:
+            self.insert(records)
+
+    def insert(self, records):
+        if self.compacted_before:
+            records = [r for r in records if r.created_at >= self.compacted_before]
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+            [r[:6] for r in records]
+        )
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO mentions VALUES (?, ?)",
+            [(r.id, member_id) for r in records for member_id in r.mentions]
+        )
+
+    def flush(self):
+        if not self.pending and not self.dirty:
+            return
+        records, self.pending = self.pending, []
+        dirty, self.dirty = self.dirty, set()
+        with self.conn:
+            self.insert(records)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cursors VALUES (?, ?, ?)",
+                [(channel_id, *self.cursors[channel_id]) for channel_id in dirty]
+            )
+
+    def rollup_delta(self, message_id: int, messages=0, chars=0, mentions=0):
+        """Adjust rollup bucket of an indexed message. Call inside a transaction."""
+        self.conn.execute(
+            "UPDATE rollups SET messages = messages + ?, chars = chars + ?, mentions = mentions + ? "
+            "WHERE (hour, channel_id, author_id) = ("
+            "SELECT CAST(created_at / 3600 AS INTEGER), channel_id, author_id FROM messages WHERE id = ?)",
+            (messages, chars, mentions, message_id)
+        )
+
+    def indexed(self, message_id: int):
+        """(length, mention count) of an indexed message or None."""
+        row = self.conn.execute("SELECT length FROM messages WHERE id = ?", (message_id,)).fetchone()
+        if row is None:
+            return None
+        mentions = self.conn.execute(
+            "SELECT COUNT(*) FROM mentions WHERE message_id = ?", (message_id,)
+        ).fetchone()[0]
+        return row[0], mentions
+
+    def edit(self, record: MessageRecord):
+        self.flush()
+        with self.conn:
+            indexed = self.indexed(record.id)
+            if indexed is None:
+                return
+            length, mentions = indexed
+            self.rollup_delta(record.id, chars=record.length - length, mentions=-mentions)
+            self.conn.execute(
+                "UPDATE messages SET length = ? WHERE id = ?",
+                (record.length, record.id)
+            )
+            self.conn.execute("DELETE FROM mentions WHERE message_id = ?", (record.id,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO mentions VALUES (?, ?)",
+                [(record.id, member_id) for member_id in record.mentions]
+            )
+
+    def delete(self, message_id: int):
+        self.delete_many([message_id])
+
+    def delete_many(self, message_ids):
+        """Remove messages and their counts in one transaction."""
+        self.flush()
+        with self.conn:
+            for message_id in message_ids:
+                indexed = self.indexed(message_id)
+                if indexed is None:
+                    continue
+                length, mentions = indexed
+                self.rollup_delta(message_id, messages=-1, chars=-length, mentions=-mentions)
+                self.conn.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+                self.conn.execute("DELETE FROM mentions WHERE message_id = ?", (message_id,))
+
+    def count(self) -> int:
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def table_counts(self):
+        """Row count of messages, hourly rollups and daily rollups."""
+        return {
+            table: self.read_conn().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ['messages', 'rollups', 'daily_rollups']
+        }
+
+    async def compact(self, retention_days=0, hourly_retention_days=0, now=None):
+        """Apply retention in small transactions, yielding to the event loop between them.
+
+        Messages older than retention_days are deleted; their counts stay in
+        the rollups. Hourly rollups older than hourly_retention_days are
+        summed into daily rollups. 0 keeps rows forever.
+        Return (messages deleted, hourly rollups downsampled).
+        """
+        now = now or time.time()
+        self.flush()
+        deleted = downsampled = 0
+
+        if retention_days > 0:
+            cutoff = now - retention_days * 86400
+            if cutoff > self.compacted_before:
+                # set first, so messages in the range are not inserted while deleting
+                self.compacted_before = cutoff
+                self.set_meta('compacted_before', cutoff)
+            while True:
+                with self.conn:
+                    ids = [
+                        (message_id,) for message_id, in self.conn.execute(
+                            "SELECT id FROM messages WHERE created_at < ? LIMIT ?",
+                            (self.compacted_before, COMPACT_CHUNK_SIZE)
+                        )
+                    ]
+                    self.conn.executemany("DELETE FROM mentions WHERE message_id = ?", ids)
+                    self.conn.executemany("DELETE FROM messages WHERE id = ?", ids)
+                deleted += len(ids)
+                if len(ids) < COMPACT_CHUNK_SIZE:
+                    break
+                await asyncio.sleep(0)
+
+        if hourly_retention_days > 0:
+            cutoff_hour = (int(now // 86400) - hourly_retention_days) * 24
+            if cutoff_hour * 3600 > self.hourly_before:
+                self.hourly_before = cutoff_hour * 3600
+                self.set_meta('hourly_before', self.hourly_before)
+            while True:
+                oldest = self.conn.execute("SELECT MIN(hour) FROM rollups").fetchone()[0]
+                if oldest is None or oldest >= cutoff_hour:
+                    break
+                end = min(cutoff_hour, (oldest // 24 + DOWNSAMPLE_CHUNK_DAYS) * 24)
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT INTO daily_rollups "
+                        "SELECT hour / 24, channel_id, author_id, SUM(messages), SUM(chars), SUM(mentions) "
+                        "FROM rollups WHERE hour < ? GROUP BY 1, 2, 3 "
+                        "ON CONFLICT (day, channel_id, author_id) DO UPDATE SET "
+                        "messages = messages + excluded.messages, chars = chars + excluded.chars, "
+                        "mentions = mentions + excluded.mentions",
+                        (end,)
+                    )
+                    downsampled += self.conn.execute("DELETE FROM rollups WHERE hour < ?", (end,)).rowcount
+                await asyncio.sleep(0)
+
+        if deleted or downsampled:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted, downsampled
+
+    def sum_window(self, key: str, after: dt.datetime, where="", params=()):
+        """Message, character and mention count grouped by key since after.
+
+        Whole days are summed from daily rollups, whole hours from rollups and
+        the leading partial hour is counted from messages, so the result is
+        exact while messages are kept. Past retention, the leading partial
+        hour or day only has its rollup and is counted whole.
+        Return list of (key, messages, chars, mentions).
+        """
+        after_ts = to_timestamp(after)
+        if after_ts < self.hourly_before:
+            day = math.floor(after_ts / 86400)
+            hour = math.ceil(self.hourly_before / 3600)
+            # messages before hourly_before are already in the daily rollups
+            end = after_ts
+        elif after_ts < self.compacted_before:
+            day = math.ceil(after_ts / 86400)
+            hour = math.floor(after_ts / 3600)
+            end = after_ts
+        else:
+            day = math.ceil(after_ts / 86400)
+            hour = math.ceil(after_ts / 3600)
+            end = hour * 3600
+        return self.read_conn().execute(
+            f"SELECT {key}, SUM(messages), SUM(chars), SUM(mentions) FROM ("
+            f"SELECT {key}, messages, chars, mentions FROM daily_rollups WHERE day >= ? {where} "
+            f"UNION ALL "
+            f"SELECT {key}, messages, chars, mentions FROM rollups WHERE hour >= ? {where} "
+            f"UNION ALL "
+            f"SELECT {key}, 1 AS messages, length AS chars, "
+            f"(SELECT COUNT(*) FROM mentions WHERE message_id = id) AS mentions "
+            f"FROM messages WHERE created_at >= ? AND created_at < ? {where}"
+            f") GROUP BY {key} HAVING SUM(messages) > 0",
+            (day, *params, hour, *params, after_ts, end, *params)
+        ).fetchall()
+
+    def last_seen(self, after: dt.datetime, author_id: int = None):
+        """Last message datetime by author id."""
+        sql = "SELECT author_id, MAX(created_at) FROM messages WHERE created_at >= ?"
+        params = (to_timestamp(after),)
+        if author_id is not None:
+            sql += " AND author_id = ?"
+            params += (author_id,)
+        rows = self.read_conn().execute(sql + " GROUP BY author_id", params).fetchall()
+        return {author_id: from_timestamp(created_at) for author_id, created_at in rows}
+
+    def channel_last_seen(self, after: dt.datetime):
+        """List of (channel_id, author_id, last message datetime).
+
+        Authors whose messages have been compacted are last seen at the start
+        of their last hourly or daily rollup.
+        """
+        after_ts = to_timestamp(after)
+        rows = self.read_conn().execute(
+            "SELECT channel_id, author_id, MAX(t) FROM ("
+            "SELECT channel_id, author_id, created_at AS t FROM messages WHERE created_at >= ? "
+            "UNION ALL "
+            "SELECT channel_id, author_id, hour * 3600 FROM rollups WHERE hour >= ? "
+            "UNION ALL "
+            "SELECT channel_id, author_id, day * 86400 FROM daily_rollups WHERE day >= ?"
+            ") GROUP BY channel_id, author_id",
+            (after_ts, math.ceil(after_ts / 3600), math.ceil(after_ts / 86400))
+        ).fetchall()
+        return [(channel_id, author_id, from_timestamp(created_at)) for channel_id, author_id, created_at in rows]
+
+    def interactions(self, after: dt.datetime, channel_ids=None):
+        """Mention and reply edges as (kind, author_id, target_id, count).
+
+        Replies are only resolved when the replied message is indexed too.
+        """
+        where = ""
+        params = (to_timestamp(after),)
+        if channel_ids is not None:
+            where = " AND m.channel_id IN ({})".format(", ".join("?" * len(channel_ids)))
+            params += tuple(channel_ids)
+        mentions = self.read_conn().execute(
+            "SELECT 'mentions', m.author_id, x.member_id, COUNT(*) FROM messages m "
+            "JOIN mentions x ON x.message_id = m.id "
+            "WHERE m.created_at >= ?" + where + " GROUP BY 2, 3",
+            params
+        ).fetchall()
+        replies = self.read_conn().execute(
+            "SELECT 'replies', m.author_id, r.author_id, COUNT(*) FROM messages m "
+            "JOIN messages r ON r.id = m.reply_to "
+            "WHERE m.created_at >= ?" + where + " GROUP BY 2, 3",
+            params
+        ).fetchall()
+        return mentions + replies
+
+    def hourly_counts(self, after: dt.datetime):
+        """Message count by hour since the epoch, channel id and author id.
+
+        Return list of (hour, channel_id, author_id, messages).
+        """
+        after_ts = to_timestamp(after)
+        hour = math.ceil(after_ts / 3600)
+        return self.read_conn().execute(
+            "SELECT hour, channel_id, author_id, SUM(messages) FROM ("
+            "SELECT hour, channel_id, author_id, messages FROM rollups WHERE hour >= ? "
+            "UNION ALL "
+            "SELECT CAST(created_at / 3600 AS INTEGER) AS hour, channel_id, author_id, 1 AS messages "
+            "FROM messages WHERE created_at >= ? AND created_at < ?"
+            ") GROUP BY hour, channel_id, author_id HAVING SUM(messages) > 0",
+            (hour, after_ts, hour * 3600)
+        ).fetchall()
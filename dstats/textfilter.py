@@ -0,0 +1,75 @@
+import re
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Plain term lists at least this long use an Aho-Corasick automaton if pyahocorasick is installed
+AUTOMATON_MIN_TERMS = 20
+
+
+class TextFilter:
+    """Message content filter matching any of several terms in one pass.
+
+    Terms are plain substrings, or regular expressions if regex is set, and
+    match case insensitively unless case_sensitive is set. Plain terms and
+    content are compared casefolded on both paths, so "ß" matches "SS"
+    whichever path runs; regular expressions use re.IGNORECASE. Everything is
+    compiled once: terms into one alternation, or for long plain term lists
+    into an Aho-Corasick automaton, so the cost per message does not grow
+    with the number of terms.
+    """
+
+    def __init__(self, terms, regex=False, case_sensitive=False):
+        self.terms = list(terms)
+        self.regex = regex
+        self.case_sensitive = case_sensitive
+        self.automaton = None
+        self.pattern = None
+
+        if not regex and ahocorasick is not None and len(self.terms) >= AUTOMATON_MIN_TERMS:
+            self.automaton = ahocorasick.Automaton()
+            for term in self.terms:
+                key = self.fold(term)
+                self.automaton.add_word(key, key)
+            self.automaton.make_automaton()
+        else:
+            if regex:
+                patterns = self.terms
+            else:
+                # longest first, so a term is not shadowed by its prefix
+                keys = sorted(set(self.fold(term) for term in self.terms), key=len, reverse=True)
+                patterns = [re.escape(key) for key in keys]
+            flags = re.IGNORECASE if regex and not case_sensitive else 0
+            self.pattern = re.compile("|".join(f"(?:{p})" for p in patterns), flags)
+
+    @classmethod
+    def from_args(cls, pargs):
+        """Filter from -t, --regex and --case-sensitive arguments, None without terms.
+
+        Raise re.error if a regular expression is invalid.
+        """
+        terms = [term for term in pargs.text or [] if term]
+        if not terms:
+            return None
+        return cls(terms, regex=pargs.regex, case_sensitive=pargs.case_sensitive)
+
+    def fold(self, text):
+        return text if self.case_sensitive else text.casefold()
+
+    def __call__(self, content):
+        """True if content contains any of the terms."""
+        if self.automaton is not None:
+            for _ in self.automaton.iter(self.fold(content)):
+                return True
+            return False
+        if not self.regex:
+            content = self.fold(content)
+        return self.pattern.search(content) is not None
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __str__(self):
+        return " | ".join(self.terms)
@@ -1,4 +1,51 @@
-def get_emoji(bot, name, remove_dash=True):
+class EmojiIndex:
+    """Bot-wide index of custom emojis by name.
+
+    Built from the guild cache on first use and kept current by the cog
+    listeners, so lookups do not scan every emoji of every guild.
+    When several guilds have an emoji with the same name, the one indexed
+    first is returned.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.built = False
+        self.by_name = dict()
+        self.guild_names = dict()
+
+    def build(self):
+        self.by_name = dict()
+        self.guild_names = dict()
+        for guild in self.bot.guilds:
+            self.set_guild(guild, guild.emojis)
+        self.built = True
+
+    def set_guild(self, guild, emojis):
+        self.remove_guild(guild)
+        names = set()
+        for emoji in emojis:
+            self.by_name.setdefault(emoji.name, dict())[emoji.id] = emoji
+            names.add(emoji.name)
+        self.guild_names[guild.id] = names
+
+    def remove_guild(self, guild):
+        for name in self.guild_names.pop(guild.id, set()):
+            emojis = self.by_name.get(name, dict())
+            for emoji_id in [e.id for e in emojis.values() if e.guild_id == guild.id]:
+                del emojis[emoji_id]
+            if not emojis:
+                self.by_name.pop(name, None)
+
+    def get(self, name):
+        if not self.built:
+            self.build()
+        emojis = self.by_name.get(name)
+        if not emojis:
+            return None
+        return next(iter(emojis.values()))
+
+
+def get_emoji(index: EmojiIndex, name, remove_dash=True):
     """Return emoji by name
 
     name is used by this cog.
@@ -9,8 +56,7 @@ def get_emoji(bot, name, remove_dash=True):
     if remove_dash:
         name = name.replace('-', '')
 
-    for guild in bot.guilds:
-        for emoji in guild.emojis:
-            if emoji.name == name:
-                return f'<:{emoji.name}:{emoji.id}>'
-    return f':{name}:'
\ No newline at end of file
+    emoji = index.get(name)
+    if emoji is not None:
+        return f'<:{emoji.name}:{emoji.id}>'
+    return f':{name}:'
@@ -0,0 +1,48 @@
+import re
+
+from .sketch import SpaceSaving
+from .stopwords import STOP_WORDS
+
+# URLs and user / role / channel mentions are matched so they can be skipped
+TOKEN_RE = re.compile(
+    r"(?P<skip>https?://\S+|<[@#][!&]?\d+>)"
+    r"|(?P<emoji><a?:\w+:\d+>|:[\w-]+:)"
+    r"|(?P<word>[^\W\d_]+(?:['’][^\W\d_]+)*)"
+)
+
+
+def tokenize(text):
+    """Yield lowercase words and emoji of text, without stop words."""
+    for m in TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == 'skip':
+            continue
+        token = m.group()
+        if kind == 'word':
+            token = token.lower().replace('’', "'")
+            if token in STOP_WORDS:
+                continue
+        yield token
+
+
+class WordCounter:
+    """Streaming n-gram counter with one bounded top-k counter per n."""
+
+    def __init__(self, ngrams=(1,), capacity=5000):
+        self.ngrams = sorted(set(ngrams))
+        self.counters = {n: SpaceSaving(capacity) for n in self.ngrams}
+        self.messages = 0
+
+    def add_text(self, text):
+        self.messages += 1
+        tokens = list(tokenize(text))
+        for n in self.ngrams:
+            counter = self.counters[n]
+            if n == 1:
+                counter.update(tokens)
+            else:
+                for i in range(len(tokens) - n + 1):
+                    counter.add(' '.join(tokens[i:i + n]))
+
+    def most_common(self, n, top=100):
+        return self.counters[n].most_common(top)
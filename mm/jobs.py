@@ -0,0 +1,204 @@
+import asyncio
+import time
+
+import discord
+
+from .throttle import DEFAULT_CONCURRENCY
+from .throttle import TokenBucket
+
+# Seconds between checkpoints of a running job to config
+CHECKPOINT_INTERVAL = 10
+
+# Seconds between edits of the status message
+STATUS_INTERVAL = 5
+
+RUNNING = 'running'
+CANCELLED = 'cancelled'
+FINISHED = 'finished'
+
+
+def role_diff(member: discord.Member, add_ids, remove_ids):
+    """(role ids to add, role ids to remove) for member, leaving out roles already in place."""
+    have = set(r.id for r in member.roles)
+    return [r for r in add_ids if r not in have], [r for r in remove_ids if r in have]
+
+
+class RoleJob:
+    """Bulk role change over the members of a query, persisted in the guild config.
+
+    Only counters and failures are checkpointed. A role diff is idempotent,
+    so a resumed job recomputes the member set and skips members whose roles
+    are already in place, without storing which members were processed.
+    Explicit member lists, for commands naming members, are stored as is.
+    """
+
+    def __init__(self, id, guild_id, channel_id, author_id, add_ids, remove_ids, query=None, member_ids=None,
+                 dry_run=False, state=RUNNING, done=0, unchanged=0, failed=None, message_id=None,
+                 created=None, elapsed=0.0):
+        self.id = id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.add_ids = list(add_ids)
+        self.remove_ids = list(remove_ids)
+        self.query = query
+        self.member_ids = member_ids
+        self.dry_run = dry_run
+        self.state = state
+        self.done = done
+        self.unchanged = unchanged
+        self.failed = failed or dict()
+        self.message_id = message_id
+        self.created = created or time.time()
+        # seconds run before the last restart
+        self.elapsed_before = elapsed
+        self.started = time.monotonic()
+        self.total = 0
+        self.task = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            guild_id=self.guild_id,
+            channel_id=self.channel_id,
+            author_id=self.author_id,
+            add_ids=self.add_ids,
+            remove_ids=self.remove_ids,
+            query=self.query,
+            member_ids=self.member_ids,
+            dry_run=self.dry_run,
+            state=self.state,
+            done=self.done,
+            unchanged=self.unchanged,
+            failed=self.failed,
+            message_id=self.message_id,
+            created=self.created,
+            elapsed=self.elapsed,
+        )
+
+    @property
+    def elapsed(self):
+        if self.state != RUNNING:
+            return self.elapsed_before
+        return self.elapsed_before + time.monotonic() - self.started
+
+    @property
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    def cancel(self):
+        if self.state == RUNNING:
+            self.elapsed_before = self.elapsed
+            self.state = CANCELLED
+
+    def finish(self):
+        if self.state == RUNNING:
+            self.elapsed_before = self.elapsed
+            self.state = FINISHED
+
+    def describe(self, guild: discord.Guild):
+        """Role diff and member set as text."""
+        def names(role_ids, prefix):
+            return [prefix + getattr(guild.get_role(role_id), 'name', str(role_id)) for role_id in role_ids]
+
+        diff = " ".join(names(self.add_ids, "+") + names(self.remove_ids, "-"))
+        if self.query is not None:
+            return f"{diff} for `{self.query}`"
+        return f"{diff} for {len(self.member_ids or [])} members"
+
+    def status(self, guild: discord.Guild):
+        if self.dry_run and self.state == FINISHED:
+            state = "Dry run"
+        else:
+            state = self.state.capitalize()
+        verb = "would change" if self.dry_run else "changed"
+        remaining = ""
+        if self.state == RUNNING and self.done:
+            rate = self.done / self.elapsed
+            left = max(0, self.total - self.done - self.unchanged - len(self.failed))
+            if rate > 0:
+                remaining = f", about {left / rate:.0f}s left"
+        return (
+            "Role job #{id} {state}: {description}\n"
+            "{verb} {done:,}, unchanged {unchanged:,}, failed {failed:,} of {total:,} members, "
+            "{elapsed:.0f}s elapsed{remaining}".format(
+                id=self.id,
+                state=state,
+                description=self.describe(guild),
+                verb=verb,
+                done=self.done,
+                unchanged=self.unchanged,
+                failed=len(self.failed),
+                total=max(self.total, self.done + self.unchanged + len(self.failed)),
+                elapsed=self.elapsed,
+                remaining=remaining,
+            )
+        )
+
+
+async def run_job(job: RoleJob, members, apply, save, show, concurrency=DEFAULT_CONCURRENCY,
+                  bucket: TokenBucket = None):
+    """Apply the role diff of job to members, concurrency members at a time and paced by bucket.
+
+    apply(member, add_ids, remove_ids) edits one member, save(job) checkpoints
+    the job and show(job) updates its status message. Members which fail are
+    recorded with the error and skipped. Return job.
+    """
+    # members which failed before a restart are counted in job.failed already
+    members = [m for m in members if str(m.id) not in job.failed]
+    job.total = job.done + job.unchanged + len(job.failed) + len(members)
+    last_checkpoint = last_status = time.monotonic()
+
+    async def visit(member, add_ids, remove_ids):
+        if bucket is not None:
+            await bucket.acquire()
+        if job.cancelled:
+            return
+        try:
+            await apply(member, add_ids, remove_ids)
+        except discord.HTTPException as e:
+            job.failed[str(member.id)] = str(e)
+        else:
+            job.done += 1
+
+    await show(job)
+    pending = set()
+    try:
+        for count, member in enumerate(members, 1):
+            if job.cancelled:
+                break
+            if count % 1000 == 0:
+                await asyncio.sleep(0)
+            add_ids, remove_ids = role_diff(member, job.add_ids, job.remove_ids)
+            if not add_ids and not remove_ids:
+                job.unchanged += 1
+                continue
+            if job.dry_run:
+                job.done += 1
+                continue
+            pending.add(asyncio.ensure_future(visit(member, add_ids, remove_ids)))
+            if len(pending) >= concurrency:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            now = time.monotonic()
+            if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                await save(job)
+                last_checkpoint = now
+            if now - last_status >= STATUS_INTERVAL:
+                await show(job)
+                last_status = now
+        if pending:
+            await asyncio.wait(pending)
+    except asyncio.CancelledError:
+        # the edits in flight would outlive the job, on unload for instance
+        for future in pending:
+            future.cancel()
+        raise
+
+    job.finish()
+    await save(job)
+    await show(job)
+    return job
@@ -1,6 +1,10 @@
 import argparse
 import asyncio
+import csv
+import io
 import itertools
+import logging
+import time
 from random import choice
 
 import discord
@@ -10,10 +14,37 @@ from redbot.core import Config
 from redbot.core.bot import Red
 from redbot.core.utils.chat_formatting import box
 from redbot.core.utils.chat_formatting import pagify
+from redbot.core.utils.menus import DEFAULT_CONTROLS
+from redbot.core.utils.menus import menu
 from redbot.core.utils.mod import is_mod_or_superior
 
+from .jobs import RUNNING
+from .jobs import RoleJob
+from .jobs import role_diff
+from .jobs import run_job
+from .nameindex import NameIndex
+from .query import QueryError
+from .query import combine
+from .query import compile_query
+from .query import names_plan
+from .roleindex import RoleIndex
+from .throttle import DEFAULT_CONCURRENCY
+from .throttle import DEFAULT_RATE
+from .throttle import MAX_CONCURRENCY
+from .throttle import TokenBucket
+from .throttle import throttled
+
+logger = logging.getLogger(__name__)
+
 BOT_COMMANDER_ROLES = ["Bot Commander", "High-Elder"]
 
+# Finished and cancelled role jobs kept in config
+ROLE_JOB_HISTORY = 20
+
+# Members listed by searchmember, in pages of
+MAX_SEARCH_RESULTS = 100
+SEARCH_RESULTS_PER_PAGE = 10
+
 
 def grouper(n, iterable, fillvalue=None):
     """Helper function to split lists.
@@ -71,9 +102,97 @@ class MemberManagement(commands.Cog):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=209287691722817536, force_registration=True)
         default_global = {}
-        default_guild = {}
+        default_guild = {
+            'macros': {},
+            'role_jobs': {},
+            'next_role_job': 1,
+            'role_edit_concurrency': DEFAULT_CONCURRENCY,
+            'role_edit_rate': DEFAULT_RATE,
+        }
         self.config.register_global(**default_global)
         self.config.register_guild(**default_guild)
+        self.role_index = RoleIndex()
+        self.name_index = NameIndex()
+        self.macro_plans = dict()
+        self.role_jobs = dict()
+        self.buckets = dict()
+        self.resume_task = self.bot.loop.create_task(self.resume_role_jobs())
+
+    def cog_unload(self):
+        self.resume_task.cancel()
+        # running jobs stay running in config and resume when the cog is loaded again
+        for job in self.role_jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+
+    @commands.Cog.listener(name="on_ready")
+    async def on_ready(self):
+        """Rebuild role index from the new guild cache, name indexes on their next search."""
+        self.role_index.build(self.bot.guilds)
+        self.name_index.clear()
+
+    @commands.Cog.listener(name="on_guild_join")
+    async def on_guild_join(self, guild: discord.Guild):
+        self.role_index.get(guild)
+
+    @commands.Cog.listener(name="on_guild_remove")
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.role_index.remove_guild(guild)
+        self.name_index.remove_guild(guild)
+
+    @commands.Cog.listener(name="on_member_join")
+    async def on_member_join(self, member: discord.Member):
+        for index in [self.role_index.indexed(member.guild), self.name_index.indexed(member.guild)]:
+            if index is not None:
+                index.add_member(member)
+
+    @commands.Cog.listener(name="on_member_remove")
+    async def on_member_remove(self, member: discord.Member):
+        for index in [self.role_index.indexed(member.guild), self.name_index.indexed(member.guild)]:
+            if index is not None:
+                index.remove_member(member)
+
+    @commands.Cog.listener(name="on_member_update")
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            index = self.role_index.indexed(after.guild)
+            if index is not None:
+                index.update_member(before, after)
+        if before.display_name != after.display_name:
+            index = self.name_index.indexed(after.guild)
+            if index is not None:
+                index.add_member(after)
+
+    @commands.Cog.listener(name="on_user_update")
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        """Reindex names of the user in every guild after a username or discriminator change."""
+        if before.name == after.name and before.discriminator == after.discriminator:
+            return
+        for guild in self.bot.guilds:
+            index = self.name_index.indexed(guild)
+            member = guild.get_member(after.id)
+            if index is not None and member is not None:
+                index.add_member(member)
+
+    @commands.Cog.listener(name="on_guild_role_create")
+    async def on_guild_role_create(self, role: discord.Role):
+        index = self.role_index.indexed(role.guild)
+        if index is not None:
+            index.add_role(role)
+
+    @commands.Cog.listener(name="on_guild_role_delete")
+    async def on_guild_role_delete(self, role: discord.Role):
+        index = self.role_index.indexed(role.guild)
+        if index is not None:
+            index.remove_role(role)
+
+    @commands.Cog.listener(name="on_guild_role_update")
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.name == after.name:
+            return
+        index = self.role_index.indexed(after.guild)
+        if index is not None:
+            index.rename_role(before, after)
 
     def parser(self):
         """Process MM arguments."""
@@ -111,11 +230,32 @@ class MemberManagement(commands.Cog):
             choices=['embed', 'csv', 'list', 'none'],
             default='embed',
             help='How to display results')
+        parser.add_argument(
+            '-q', '--query',
+            nargs='+',
+            help='Role query, e.g. (Member | Elder) & !Heist')
         parser.add_argument(
             '-m', '--macro',
-            help='Macro name. Create using [p]mmset')
+            help='Macro name. Create using [p]mmset macro')
         return parser
 
+    async def get_macro(self, guild, name):
+        """Compiled plan of a macro, None if it does not exist.
+
+        Raise QueryError if the saved query no longer compiles.
+        """
+        name = name.lower()
+        plans = self.macro_plans.get(guild.id)
+        if plans is None:
+            plans = self.macro_plans[guild.id] = dict()
+        plan = plans.get(name)
+        if plan is None:
+            query = (await self.config.guild(guild).macros()).get(name)
+            if query is None:
+                return None
+            plan = plans[name] = compile_query(query)
+        return plan
+
     @commands.guild_only()
     @check_is_mod_or_has_roles(["Staff", "FamilyLead", "BS-FamilyLead"])
     @commands.command()
@@ -124,7 +264,7 @@ class MemberManagement(commands.Cog):
 
         !mm [-h] [-x EXCLUDE [EXCLUDE ...]]
              [-o {id,mention,mentiononly}] [-r1] [-e] [-s {join,alpha}]
-             [-r {embed,csv,list,none}] [-m MACRO]
+             [-r {embed,csv,list,none}] [-q QUERY [QUERY ...]] [-m MACRO]
              [roles [roles ...]]
 
         Find members with roles: Member, Elder
@@ -138,6 +278,12 @@ class MemberManagement(commands.Cog):
         !mm Alpha Elder --output id
         !mm Alpha Elder -o id
 
+        Find members with roles: Member or Elder, but not Heist
+        !mm -q (Member | Elder) & !Heist
+
+        Run a saved query
+        !mm -m elders
+
         Optional arguments
         --exclude, -x
             Exclude list of roles
@@ -156,6 +302,12 @@ class MemberManagement(commands.Cog):
             none: Do not display results (show only count + output specified.
         --everyone
             Include everyone. Useful for finding members without specific roles.
+        --query, -q
+            Role query with & (and), | (or), ! (not) and parentheses.
+            Quote role names containing these characters.
+        --macro, -m
+            Saved query. Create using [p]mmset macro
+        Roles, queries and macros given together must all match.
         """
         parser = self.parser()
         try:
@@ -175,11 +327,21 @@ class MemberManagement(commands.Cog):
         option_only_role = pargs.onlyrole
 
         guild = ctx.message.guild
-        guild_roles_names = [r.name.lower() for r in guild.roles]
-        plus = set([r.lower() for r in pargs.roles if r.lower() in guild_roles_names])
+        index = self.role_index.get(guild)
+        plus = set([r.lower() for r in pargs.roles if index.role_ids(r)])
         minus = set()
         if pargs.exclude is not None:
-            minus = set([r.lower() for r in pargs.exclude if r.lower() in guild_roles_names])
+            minus = set([r.lower() for r in pargs.exclude if index.role_ids(r)])
+
+        try:
+            query = compile_query(' '.join(pargs.query)) if pargs.query else None
+            macro = await self.get_macro(guild, pargs.macro) if pargs.macro else None
+        except QueryError as e:
+            await ctx.send("Invalid query: {}".format(e))
+            return
+        if pargs.macro and macro is None:
+            await ctx.send("Macro {} not found. Create using `{}mmset macro`.".format(pargs.macro, ctx.prefix))
+            return
 
         out = ["**Member Management**"]
 
@@ -194,28 +356,33 @@ class MemberManagement(commands.Cog):
             'Syntax Error: You must include at '
             'least one role to display results.')
 
-        if len(plus) < 1:
+        plan = None
+        if query is not None or macro is not None:
+            plan = combine(names_plan(plus, minus), query, macro)
+            missing = plan.missing(index)
+            if missing:
+                await ctx.send("Cannot find roles: {}".format(', '.join(missing)))
+                return
+            out.append("Listing members matching: {}".format(
+                str(plan).replace('@everyone', 'everyone')))
+        elif len(plus) < 1:
             out.append(help_str)
         else:
+            plan = names_plan(plus, minus)
             out.append("Listing members who have these roles: {}".format(
                 ', '.join(plus_out)))
-        if len(minus):
-            out.append("but not these roles: {}".format(
-                ', '.join(minus)))
+            if len(minus):
+                out.append("but not these roles: {}".format(
+                    ', '.join(minus)))
 
         await ctx.send('\n'.join(out))
 
         # only output if argument is supplied
-        if len(plus):
-            # include roles with '+' flag
-            # exclude roles with '-' flag
+        if plan is not None:
             out_members = set()
-            for m in guild.members:
-                roles = set([r.name.lower() for r in m.roles])
-                if option_everyone:
-                    roles.add('@everyone')
-                exclude = len(roles & minus)
-                if not exclude and roles >= plus:
+            for member_id in index.bitset_members(plan.evaluate(index)):
+                m = guild.get_member(member_id)
+                if m is not None:
                     out_members.add(m)
 
             # only role
@@ -333,6 +500,76 @@ class MemberManagement(commands.Cog):
             roles = guild.roles
         return roles
 
+    @commands.guild_only()
+    @commands.group()
+    @checks.admin_or_permissions(manage_guild=True)
+    async def mmset(self, ctx):
+        """Member management settings."""
+        pass
+
+    @mmset.command(name="macro")
+    async def mmset_macro(self, ctx, name, *query):
+        """Save a role query as a macro for [p]mm -m.
+
+        !mmset macro elders (Elder | Co-Leader) & !Heist
+        """
+        if not query:
+            await ctx.send_help()
+            return
+        query = ' '.join(query)
+        try:
+            plan = compile_query(query)
+        except QueryError as e:
+            await ctx.send("Invalid query: {}".format(e))
+            return
+        missing = plan.missing(self.role_index.get(ctx.guild))
+        async with self.config.guild(ctx.guild).macros() as macros:
+            macros[name.lower()] = query
+        self.macro_plans.get(ctx.guild.id, {}).pop(name.lower(), None)
+        await ctx.send("Saved macro {}: {}".format(name.lower(), plan))
+        if missing:
+            await ctx.send("Warning: cannot find roles: {}".format(', '.join(missing)))
+
+    @mmset.command(name="concurrency")
+    async def mmset_concurrency(self, ctx, edits: int):
+        """Number of member role edits in flight at the same time for bulk commands."""
+        if not 1 <= edits <= MAX_CONCURRENCY:
+            await ctx.send("Concurrency must be between 1 and {}.".format(MAX_CONCURRENCY))
+            return
+        await self.config.guild(ctx.guild).role_edit_concurrency.set(edits)
+        await ctx.send("Bulk role commands edit up to {} members at the same time.".format(edits))
+
+    @mmset.command(name="rate")
+    async def mmset_rate(self, ctx, per_second: float):
+        """Average number of member role edits per second for bulk commands."""
+        if per_second <= 0:
+            await ctx.send("Rate must be positive.")
+            return
+        await self.config.guild(ctx.guild).role_edit_rate.set(per_second)
+        await ctx.send("Bulk role commands edit up to {} members per second.".format(per_second))
+
+    @mmset.command(name="removemacro")
+    async def mmset_remove_macro(self, ctx, name):
+        """Remove a macro."""
+        async with self.config.guild(ctx.guild).macros() as macros:
+            query = macros.pop(name.lower(), None)
+        self.macro_plans.get(ctx.guild.id, {}).pop(name.lower(), None)
+        if query is None:
+            await ctx.send("Macro {} not found.".format(name))
+        else:
+            await ctx.send("Removed macro {}.".format(name.lower()))
+
+    @mmset.command(name="macros")
+    async def mmset_macros(self, ctx):
+        """List macros."""
+        macros = await self.config.guild(ctx.guild).macros()
+        if not macros:
+            await ctx.send("No macros on this guild.")
+            return
+        out = ["**{}**: {}".format(name, query) for name, query in sorted(macros.items())]
+        for page in pagify("\n".join(out), shorten_by=12):
+            await ctx.send(page)
+
     @commands.guild_only()
     @commands.command()
     async def listroles(self, ctx, *roles):
@@ -343,19 +580,12 @@ class MemberManagement(commands.Cog):
         out = []
         out.append("__List of roles on {}__".format(guild.name))
         roles_to_list = self.get_guild_roles(guild, *roles)
+        index = self.role_index.get(guild)
 
-        out_roles = {}
         for role in roles_to_list:
-            out_roles[role.id] = {'role': role, 'count': 0}
-        for member in guild.members:
-            for role in member.roles:
-                if role in roles_to_list:
-                    out_roles[role.id]['count'] += 1
-        for role in guild.roles:
-            if role in roles_to_list:
-                out.append(
-                    "**{}** ({} members)".format(
-                        role.name, out_roles[role.id]['count']))
+            out.append(
+                "**{}** ({} members)".format(
+                    role.name, len(index.role_members(role.id))))
         for page in pagify("\n".join(out), shorten_by=12):
             await ctx.send(page)
 
@@ -389,6 +619,9 @@ class MemberManagement(commands.Cog):
         Operators are used as prefix:
         + for role addition
         - for role removal
+
+        All roles are changed in one edit, or none if any of them
+        cannot be found or edited.
         """
         guild = ctx.message.guild
         author = ctx.message.author
@@ -399,67 +632,77 @@ class MemberManagement(commands.Cog):
             await ctx.send("You must specify a role.")
             return
 
-        guild_role_names = [r.name for r in guild.roles]
-        role_args = []
-        flags = ['+', '-']
+        plus = []
+        minus = []
+        unknown = []
         for role in roles:
-            has_flag = role[0] in flags
+            has_flag = role[0] in ['+', '-']
             flag = role[0] if has_flag else '+'
             name = role[1:] if has_flag else role
+            guild_roles = self.get_guild_roles(guild, name)
+            if not guild_roles:
+                unknown.append(name)
+            elif flag == '+':
+                plus.extend(guild_roles)
+            else:
+                minus.extend(guild_roles)
+
+        if unknown:
+            await ctx.send("Cannot find roles: {}. No roles changed.".format(', '.join(unknown)))
+            return
+        # respect role hierarchy, for every role before changing any
+        error = self.check_role_hierarchy(author, plus + minus)
+        if error is not None:
+            await ctx.send(error + " No roles changed.")
+            return
 
-            if name.lower() in [r.lower() for r in guild_role_names]:
-                role_args.append({'flag': flag, 'name': name})
+        try:
+            added, removed = await self.edit_member_roles(member, plus, minus)
+        except discord.Forbidden:
+            await ctx.send(
+                "{} does not have permission to edit {}’s roles.".format(
+                    author.display_name, member.display_name))
+            return
+        except discord.HTTPException:
+            await ctx.send("Failed to change roles of {}.".format(member.display_name))
+            return
+        await ctx.send(self.role_change_summary(member, added, removed))
 
-        plus = [r['name'].lower() for r in role_args if r['flag'] == '+']
-        minus = [r['name'].lower() for r in role_args if r['flag'] == '-']
-        # disallowed_roles = [r.lower() for r in DISALLOWED_ROLES]
+    async def edit_member_roles(self, member, add, remove, reason=None):
+        """Remove and add roles with one member edit.
 
-        for role in guild.roles:
-            role_in_minus = role.name.lower() in minus
-            role_in_plus = role.name.lower() in plus
-            role_in_either = role_in_minus or role_in_plus
-
-            if role_in_either:
-                # respect role hiearchy
-                if role.position >= author.top_role.position:
-                    await ctx.send(
-                        "{} does not have permission to edit {}.".format(
-                            author.display_name, role.name))
-                else:
-                    try:
-                        if role_in_minus:
-                            await member.remove_roles(role)
-                        if role_in_plus:
-                            await member.add_roles(role)
-                    except discord.Forbidden:
-                        await ctx.send(
-                            "{} does not have permission to edit {}’s roles.".format(
-                                author.display_name, member.display_name))
-                        continue
-                    except discord.HTTPException:
-                        if role_in_minus:
-                            await ctx.send(
-                                "Failed to remove {}.").format(role.name)
-                            continue
-                        if role_in_plus:
-                            await ctx.send(
-                                "failed to add {}.").format(role.name)
-                            continue
-                    else:
-                        if role_in_minus:
-                            await ctx.send(
-                                "Removed {} from {}".format(
-                                    role.name, member.display_name))
-                        if role_in_plus:
-                            await ctx.send(
-                                "Added {} for {}".format(
-                                    role.name, member.display_name))
+        Roles in both add and remove end up added, as if removed then added.
+        The new role set is computed from the cached roles of member.
+        Return (roles added, roles removed), without roles already in place.
+        """
+        current = [r for r in member.roles if not r.is_default()]
+        removed = [r for r in current if r in remove and r not in add]
+        added = [r for r in dict.fromkeys(add) if r not in current]
+        if added or removed:
+            roles = [r for r in current if r not in removed] + added
+            await member.edit(roles=roles, reason=reason)
+        return added, removed
+
+    @staticmethod
+    def role_change_summary(member, added, removed):
+        out = []
+        if added:
+            out.append("added {}".format(', '.join(r.name for r in added)))
+        if removed:
+            out.append("removed {}".format(', '.join(r.name for r in removed)))
+        if not out:
+            return "No role changes for {}.".format(member.display_name)
+        return "Changed roles of {}: {}.".format(member.display_name, '; '.join(out))
 
     @commands.guild_only()
     @commands.command()
     @checks.mod_or_permissions(manage_roles=True)
-    async def searchmember(self, ctx, name=None):
-        """Search member on guild by name."""
+    async def searchmember(self, ctx, *, name=None):
+        """Search member on guild by name.
+
+        Matches nicknames and usernames, exactly, by prefix, by substring or
+        approximately, best matches first. Add #1234 to match a discriminator.
+        """
         if name is None:
             await ctx.send_help()
             return
@@ -467,34 +710,292 @@ class MemberManagement(commands.Cog):
             return await ctx.send("Use a plain text name instead of a mention.")
         guild = ctx.message.guild
         results = []
-        for member in guild.members:
-            for member_name in [member.display_name, member.name]:
-                if name.lower() in member_name.lower():
-                    results.append(member)
-                    break
+        for score, member_id in self.name_index.get(guild).search(name, limit=MAX_SEARCH_RESULTS):
+            member = guild.get_member(member_id)
+            if member is not None:
+                results.append((score, member))
 
         if not len(results):
             await ctx.send("Cannot find any users with that name.")
             return
 
-        await ctx.send('Found {} members.'.format(len(results)))
+        embeds = []
+        pages = list(grouper(SEARCH_RESULTS_PER_PAGE, results))
+        for page, items in enumerate(pages, 1):
+            em = discord.Embed(
+                title="Found {} members for {}".format(len(results), name),
+                color=discord.Colour.blue())
+            for score, member in items:
+                role_list = ', '.join([r.name for r in member.roles if not r.is_default()])
+                em.add_field(
+                    name=member.display_name,
+                    value='\n'.join([
+                        'Username: {}'.format(str(member)),
+                        'Roles: {}'.format(role_list or 'None')[:900],
+                        'User ID: {}'.format(member.id),
+                        'Match: {:.0%}'.format(score),
+                    ]),
+                    inline=False)
+            em.set_footer(text="Page {}/{}".format(page, len(pages)))
+            embeds.append(em)
+        await menu(ctx, embeds, DEFAULT_CONTROLS)
+
+    def role_job_parser(self):
+        """Process role job arguments."""
+        parser = argparse.ArgumentParser(prog='[p]rolejob start')
+        parser.add_argument(
+            '-q', '--query',
+            nargs='+',
+            help='Role query of the members to change')
+        parser.add_argument(
+            '-m', '--macro',
+            help='Macro of the members to change')
+        parser.add_argument(
+            '-a', '--add',
+            nargs='+',
+            default=[],
+            help='Roles to add')
+        parser.add_argument(
+            '-r', '--remove',
+            nargs='+',
+            default=[],
+            help='Roles to remove')
+        parser.add_argument(
+            '-n', '--dry-run',
+            action='store_true',
+            help='Count the members which would change without editing roles')
+        return parser
 
-        for member in results:
-            role_list = (', '.join([r.name for r in member.roles])).replace("@everyone, ", "")
-            out = [
-                '---------------------',
-                'Display Name: {}'.format(member.display_name),
-                'Username: {}'.format(str(member)),
-                'Roles: {}'.format(role_list),
-                'User ID: {}'.format(member.id)
-            ]
-            await ctx.send('\n'.join(out))
+    def check_role_hierarchy(self, author, roles):
+        """Error message if author or the bot cannot edit one of roles, None otherwise."""
+        guild = author.guild
+        for role in roles:
+            if author != guild.owner and role.position >= author.top_role.position:
+                return "{} does not have permission to edit {}.".format(author.display_name, role.name)
+            if role.position >= guild.me.top_role.position:
+                return "I do not have permission to edit {}.".format(role.name)
+        return None
+
+    async def save_role_job(self, guild, job: RoleJob):
+        async with self.config.guild(guild).role_jobs() as jobs:
+            jobs[str(job.id)] = job.to_dict()
+
+    async def show_role_job(self, guild, job: RoleJob):
+        """Edit the status message of job, or send it if there is none yet."""
+        channel = guild.get_channel(job.channel_id)
+        if channel is None:
+            return
+        content = job.status(guild)
+        if job.message_id is not None:
+            try:
+                await channel.get_partial_message(job.message_id).edit(content=content)
+                return
+            except discord.NotFound:
+                pass
+            except discord.HTTPException:
+                return
+        try:
+            message = await channel.send(content)
+        except discord.HTTPException:
+            return
+        job.message_id = message.id
+
+    def role_job_members(self, guild, job: RoleJob):
+        """Members of a job, from its member ids or by running its query on the role index."""
+        if job.member_ids is not None:
+            member_ids = job.member_ids
+        else:
+            index = self.role_index.get(guild)
+            member_ids = index.bitset_members(compile_query(job.query).evaluate(index))
+        members = [guild.get_member(member_id) for member_id in member_ids]
+        return [m for m in members if m is not None]
+
+    async def apply_role_diff(self, member, add_ids, remove_ids, reason=None):
+        """Add and remove roles by id with one member edit."""
+        guild = member.guild
+        add = [r for r in map(guild.get_role, add_ids) if r is not None]
+        remove = [r for r in map(guild.get_role, remove_ids) if r is not None]
+        await self.edit_member_roles(member, add, remove, reason=reason)
+
+    async def role_edit_throttle(self, guild):
+        """(concurrency, token bucket) of role edits in guild, the bucket shared by all bulk edits."""
+        settings = await self.config.guild(guild).all()
+        bucket = self.buckets.get(guild.id)
+        if bucket is None or bucket.rate != settings['role_edit_rate']:
+            bucket = self.buckets[guild.id] = TokenBucket(settings['role_edit_rate'])
+        return settings['role_edit_concurrency'], bucket
+
+    async def run_role_job(self, guild, job: RoleJob, members):
+        reason = "Role job #{}".format(job.id)
+        concurrency, bucket = await self.role_edit_throttle(guild)
+        try:
+            await run_job(
+                job, members,
+                concurrency=concurrency,
+                bucket=bucket,
+                apply=lambda member, add_ids, remove_ids: self.apply_role_diff(
+                    member, add_ids, remove_ids, reason=reason),
+                save=lambda j: self.save_role_job(guild, j),
+                show=lambda j: self.show_role_job(guild, j),
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Role job {} of {} failed".format(job.id, guild.id))
+            job.cancel()
+            await self.save_role_job(guild, job)
+        finally:
+            self.role_jobs.pop((guild.id, job.id), None)
+
+    async def start_role_job(self, ctx, add_roles, remove_roles, query=None, member_ids=None, dry_run=False):
+        """Check permissions, save a new role job and run it in the background."""
+        error = self.check_role_hierarchy(ctx.author, list(add_roles) + list(remove_roles))
+        if error is not None:
+            await ctx.send(error)
+            return None
+        guild = ctx.guild
+        guild_config = self.config.guild(guild)
+        job_id = await guild_config.next_role_job()
+        await guild_config.next_role_job.set(job_id + 1)
+        job = RoleJob(
+            job_id, guild.id, ctx.channel.id, ctx.author.id,
+            add_ids=[r.id for r in add_roles], remove_ids=[r.id for r in remove_roles],
+            query=query, member_ids=member_ids, dry_run=dry_run,
+        )
+        async with guild_config.role_jobs() as jobs:
+            old = sorted(
+                (int(key) for key, data in jobs.items() if data['state'] != RUNNING), reverse=True
+            )[ROLE_JOB_HISTORY:]
+            for key in old:
+                del jobs[str(key)]
+            jobs[str(job.id)] = job.to_dict()
+        self.role_jobs[(guild.id, job.id)] = job
+        job.task = self.bot.loop.create_task(self.run_role_job(guild, job, self.role_job_members(guild, job)))
+        return job
+
+    async def resume_role_jobs(self):
+        """Continue jobs which were running when the bot stopped."""
+        await self.bot.wait_until_red_ready()
+        for guild_id, settings in (await self.config.all_guilds()).items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            for data in settings['role_jobs'].values():
+                if data['state'] != RUNNING:
+                    continue
+                job = RoleJob.from_dict(data)
+                if job.dry_run:
+                    # nothing was changed, count again from the start
+                    job.done = job.unchanged = 0
+                try:
+                    members = self.role_job_members(guild, job)
+                except QueryError:
+                    job.cancel()
+                    await self.save_role_job(guild, job)
+                    continue
+                if not job.dry_run:
+                    # members done before the restart already have their roles
+                    members = [m for m in members if any(role_diff(m, job.add_ids, job.remove_ids))]
+                self.role_jobs[(guild.id, job.id)] = job
+                job.task = self.bot.loop.create_task(self.run_role_job(guild, job, members))
+
+    @commands.guild_only()
+    @commands.group()
+    @checks.mod_or_permissions(manage_roles=True)
+    async def rolejob(self, ctx):
+        """Bulk role changes which survive restarts."""
+        pass
+
+    @rolejob.command(name="start")
+    async def rolejob_start(self, ctx, *args):
+        """Add and remove roles for the members of a query.
+
+        [p]rolejob start [-q QUERY [QUERY ...]] [-m MACRO]
+                         [-a ADD [ADD ...]] [-r REMOVE [REMOVE ...]] [-n]
+
+        Give Elder to members with Member but not Heist, trying it first
+        [p]rolejob start -q Member & !Heist -a Elder -n
+        [p]rolejob start -q Member & !Heist -a Elder
+
+        --dry-run, -n
+            Count the members which would change without editing roles.
+        """
+        parser = self.role_job_parser()
+        try:
+            pargs = parser.parse_args(args)
+        except SystemExit:
+            await ctx.send_help()
+            return
+        guild = ctx.guild
+        try:
+            query = compile_query(' '.join(pargs.query)) if pargs.query else None
+            macro = await self.get_macro(guild, pargs.macro) if pargs.macro else None
+        except QueryError as e:
+            await ctx.send("Invalid query: {}".format(e))
+            return
+        if pargs.macro and macro is None:
+            await ctx.send("Macro {} not found.".format(pargs.macro))
+            return
+        if query is None and macro is None:
+            await ctx.send("You must specify members with a query or a macro.")
+            return
+        plan = combine(query, macro)
+        missing = plan.missing(self.role_index.get(guild))
+        if missing:
+            await ctx.send("Cannot find roles: {}".format(', '.join(missing)))
+            return
+
+        add_roles = self.get_guild_roles(guild, *pargs.add) if pargs.add else []
+        remove_roles = self.get_guild_roles(guild, *pargs.remove) if pargs.remove else []
+        if not add_roles and not remove_roles:
+            await ctx.send("You must specify roles to add or remove.")
+            return
+        await self.start_role_job(ctx, add_roles, remove_roles, query=str(plan), dry_run=pargs.dry_run)
+
+    @rolejob.command(name="list")
+    async def rolejob_list(self, ctx):
+        """List recent role jobs."""
+        jobs = await self.config.guild(ctx.guild).role_jobs()
+        if not jobs:
+            await ctx.send("No role jobs on this guild.")
+            return
+        out = []
+        for data in sorted(jobs.values(), key=lambda d: d['id'], reverse=True):
+            job = self.role_jobs.get((ctx.guild.id, data['id'])) or RoleJob.from_dict(data)
+            out.append(job.status(ctx.guild))
+        for page in pagify("\n\n".join(out), shorten_by=12):
+            await ctx.send(page)
+
+    @rolejob.command(name="status")
+    async def rolejob_status(self, ctx, job_id: int):
+        """Show the status of a role job."""
+        job = self.role_jobs.get((ctx.guild.id, job_id))
+        if job is None:
+            data = (await self.config.guild(ctx.guild).role_jobs()).get(str(job_id))
+            if data is None:
+                await ctx.send("Role job #{} not found.".format(job_id))
+                return
+            job = RoleJob.from_dict(data)
+        await ctx.send(job.status(ctx.guild))
+
+    @rolejob.command(name="cancel")
+    async def rolejob_cancel(self, ctx, job_id: int):
+        """Cancel a running role job. Members already changed keep their roles."""
+        job = self.role_jobs.get((ctx.guild.id, job_id))
+        if job is None or job.state != RUNNING:
+            await ctx.send("Role job #{} is not running.".format(job_id))
+            return
+        job.cancel()
+        await ctx.send("Cancelling role job #{}.".format(job_id))
 
     @commands.guild_only()
     @commands.command()
     @checks.mod_or_permissions(manage_roles=True)
     async def addrole2role(self, ctx, with_role_name, to_add_role_name):
-        """Add a role to users with a specific role."""
+        """Add a role to users with a specific role.
+
+        Runs as a role job, see [p]rolejob.
+        """
         guild = ctx.message.guild
         with_role = discord.utils.get(guild.roles, name=with_role_name)
         to_add_role = discord.utils.get(guild.roles, name=to_add_role_name)
@@ -505,14 +1006,8 @@ class MemberManagement(commands.Cog):
             await ctx.send("Cannot find the role **{}** on this guild.".format(to_add_role_name))
             return
 
-        guild_members = [member for member in guild.members]
-        for member in guild_members:
-            if with_role in member.roles:
-                if to_add_role not in member.roles:
-                    try:
-                        await ctx.invoke(self.changerole, member, to_add_role_name)
-                    except:
-                        pass
+        query = str(names_plan([with_role.name]))
+        await self.start_role_job(ctx, [to_add_role], [], query=query)
 
     @commands.guild_only()
     @commands.command()
@@ -521,9 +1016,14 @@ class MemberManagement(commands.Cog):
         """Add a role to multiple users.
 
         !multiaddrole rolename User1 User2 User3
+
+        Runs as a role job, see [p]rolejob.
         """
-        for member in members:
-            await ctx.invoke(self.changerole, member, role)
+        roles = self.get_guild_roles(ctx.guild, role)
+        if not roles:
+            await ctx.send("Cannot find the role **{}** on this guild.".format(role))
+            return
+        await self.start_role_job(ctx, roles, [], member_ids=[m.id for m in members])
 
     @commands.guild_only()
     @commands.command()
@@ -532,10 +1032,14 @@ class MemberManagement(commands.Cog):
         """Remove a role from multiple users.
 
         !multiremoverole rolename User1 User2 User3
+
+        Runs as a role job, see [p]rolejob.
         """
-        role = '-{}'.format(role)
-        for member in members:
-            await ctx.invoke(self.changerole, member, role)
+        roles = self.get_guild_roles(ctx.guild, role)
+        if not roles:
+            await ctx.send("Cannot find the role **{}** on this guild.".format(role))
+            return
+        await self.start_role_job(ctx, [], roles, member_ids=[m.id for m in members])
 
     @commands.guild_only()
     @commands.command()
@@ -570,42 +1074,61 @@ class MemberManagement(commands.Cog):
         for page in pagify('\n'.join(out)):
             await ctx.send(page)
 
-    async def remove_role(self, member, role, channel=None, reason=None):
-        await member.remove_roles(
-            role,
-            reason=reason
-        )
-        if channel is not None:
-            await channel.send(
-                f"Removed {role} for {member}"
-            )
-
     @commands.guild_only()
     @commands.command()
     @checks.mod_or_permissions(manage_roles=True)
-    async def removerolefromall(self, ctx, role_name):
-        """Remove a role from all members with the role."""
+    async def removerolefromall(self, ctx, role_name, failures_csv: bool = False):
+        """Remove a role from all members with the role.
+
+        Members are edited a few at a time and paced, see [p]mmset concurrency
+        and [p]mmset rate. Results are sent in one summary, with a CSV file
+        of the failures if failures_csv is true.
+        """
         role = discord.utils.get(ctx.guild.roles, name=role_name)
         if role is None:
             await ctx.send("Role not found.")
             return
         guild = ctx.guild
+        error = self.check_role_hierarchy(ctx.author, [role])
+        if error is not None:
+            await ctx.send(error)
+            return
 
         members = []
-        for member in guild.members:
-            if role in member.roles:
+        for member_id in self.role_index.get(guild).role_members(role.id):
+            member = guild.get_member(member_id)
+            if member is not None:
                 members.append(member)
         if not members:
             await ctx.send("No members with that role found")
             return
 
+        concurrency, bucket = await self.role_edit_throttle(guild)
+        reason = "removerolefromall by {}".format(ctx.author)
+        started = time.monotonic()
         async with ctx.typing():
-            tasks = [
-                self.remove_role(member, role, channel=ctx.channel)
-                for member in members
-            ]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            for m, r in zip(members, results):
-                if isinstance(r, Exception):
-                    await ctx.send("Error removing role from {}".format(m))
-            await ctx.send("Task completed.")
+            removed, failed = await throttled(
+                members,
+                lambda m: m.remove_roles(role, reason=reason),
+                concurrency=concurrency,
+                bucket=bucket,
+                exceptions=(discord.HTTPException,),
+            )
+
+        out = ["Removed {} from {} of {} members in {:.0f}s.".format(
+            role.name, len(removed), len(members), time.monotonic() - started)]
+        if failed:
+            out.append("Failed for {} members: {}".format(
+                len(failed), ', '.join(str(m) for m, _ in failed)))
+        pages = list(pagify('\n'.join(out), shorten_by=12))
+        file = None
+        if failed and failures_csv:
+            fp = io.StringIO()
+            writer = csv.writer(fp)
+            writer.writerow(['member_id', 'member', 'error'])
+            for member, e in failed:
+                writer.writerow([member.id, str(member), str(e)])
+            file = discord.File(io.BytesIO(fp.getvalue().encode('utf-8')), filename="failures.csv")
+        for page in pages[:-1]:
+            await ctx.send(page)
+        await ctx.send(pages[-1], file=file)
@@ -0,0 +1,159 @@
+import heapq
+from collections import Counter
+from collections import defaultdict
+
+import discord
+
+# Members scored exactly after counting shared trigrams
+MAX_CANDIDATES = 500
+
+# Lowest share of trigrams in common of a fuzzy match, low enough for one
+# typo in a short name: alx and alex share 2 of 7
+MIN_SIMILARITY = 0.25
+
+# Queries shorter than this are matched as substrings of every name instead
+# of by trigrams, which only find them at word starts
+MIN_TRIGRAM_QUERY = 3
+
+
+def trigrams(text):
+    """Trigrams of the words of text, padded so short names and word starts match."""
+    grams = set()
+    for word in text.split():
+        padded = "  " + word + " "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def query_trigrams(text):
+    """Trigrams of a query. Words shorter than 3 characters only match word starts."""
+    grams = set()
+    for word in text.split():
+        padded = "  " + word + (" " if len(word) >= 3 else "")
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(query, query_grams, text):
+    """Score in [0, 1] of text for query: exact, then prefix, then substring, then trigram similarity.
+
+    Prefix and substring matches covering more of text rank higher.
+    """
+    if text == query:
+        return 1.0
+    if text.startswith(query):
+        return 0.8 + 0.1 * len(query) / len(text)
+    if query in text:
+        return 0.7 + 0.1 * len(query) / len(text)
+    grams = trigrams(text)
+    shared = len(query_grams & grams)
+    return 0.7 * shared / (len(query_grams) + len(grams) - shared)
+
+
+def member_names(member: discord.Member):
+    """Casefolded names a member can be searched by, nickname and username, and the discriminator."""
+    names = tuple(dict.fromkeys([member.display_name.casefold(), member.name.casefold()]))
+    return names, member.discriminator
+
+
+class GuildNames:
+    """Trigram index of the names of the members of one guild.
+
+    Only names are indexed, discriminators are checked on the candidates.
+    """
+
+    def __init__(self, guild: discord.Guild):
+        self.names = dict()
+        self.postings = defaultdict(set)
+        for member in guild.members:
+            self.add_member(member)
+
+    def add_member(self, member: discord.Member):
+        names = member_names(member)
+        if self.names.get(member.id) == names:
+            return
+        self.remove_member(member)
+        self.names[member.id] = names
+        for gram in set().union(*(trigrams(name) for name in names[0])):
+            self.postings[gram].add(member.id)
+
+    def remove_member(self, member: discord.Member):
+        names = self.names.pop(member.id, None)
+        if names is None:
+            return
+        for gram in set().union(*(trigrams(name) for name in names[0])):
+            member_ids = self.postings.get(gram)
+            if member_ids is not None:
+                member_ids.discard(member.id)
+                if not member_ids:
+                    del self.postings[gram]
+
+    def search(self, query, limit=100):
+        """Best matches of query as a list of (score, member id), best first.
+
+        name#1234 only matches members whose discriminator starts with 1234.
+        Queries too short for trigrams scan every name for substrings.
+        """
+        query = query.casefold().strip()
+        discriminator = None
+        if '#' in query:
+            name, _, discriminator = query.rpartition('#')
+            if discriminator.isdigit() and name:
+                query = name
+            else:
+                discriminator = None
+        if not query:
+            return []
+        grams = query_trigrams(query)
+
+        if len(query) < MIN_TRIGRAM_QUERY:
+            candidates = [
+                member_id for member_id, (names, _) in self.names.items() if any(query in name for name in names)
+            ]
+        else:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self.postings.get(gram, ()))
+            # fuzzy matches share at least this many trigrams with the query
+            least = max(1, int(len(grams) * MIN_SIMILARITY))
+            candidates = [
+                member_id for member_id, _ in heapq.nlargest(
+                    MAX_CANDIDATES, (item for item in shared.items() if item[1] >= least), key=lambda item: item[1]
+                )
+            ]
+
+        results = []
+        for member_id in candidates:
+            names, member_discriminator = self.names[member_id]
+            if discriminator is not None and not member_discriminator.startswith(discriminator):
+                continue
+            score = max(similarity(query, grams, name) for name in names)
+            if score >= 0.7 * MIN_SIMILARITY:
+                results.append((score, member_id))
+        return heapq.nlargest(limit, results)
+
+
+class NameIndex:
+    """Member name index of every guild, kept current by member and user events.
+
+    Guilds are indexed on their first search, so only guilds which search
+    pay for the index.
+    """
+
+    def __init__(self):
+        self.guilds = dict()
+
+    def get(self, guild: discord.Guild) -> GuildNames:
+        index = self.guilds.get(guild.id)
+        if index is None:
+            index = self.guilds[guild.id] = GuildNames(guild)
+        return index
+
+    def clear(self):
+        self.guilds = dict()
+
+    def remove_guild(self, guild: discord.Guild):
+        self.guilds.pop(guild.id, None)
+
+    def indexed(self, guild: discord.Guild):
+        return self.guilds.get(guild.id)
@@ -0,0 +1,206 @@
+"""Boolean queries over role names.
+
+    (Member | Elder) & !Heist
+    Delta Lead & !"Delta Elder"
+
+& is and, | is or, ! or - is not, and parentheses group. Names are case
+insensitive. Consecutive words form one name, so names with spaces only
+need quotes where they could be read as operators.
+
+A query compiles once into a postfix plan, evaluated on a stack of member
+bitsets from GuildRoles.bitset(), where and, or and not are single integer
+operations however many members the guild has.
+"""
+import re
+from functools import lru_cache
+
+TOKEN = re.compile(r'\s*(?:(?P<op>[&|!()-])|"(?P<dquoted>[^"]*)"|\'(?P<squoted>[^\']*)\'|(?P<word>[^\s&|!()"\']+))')
+
+ROLE = 'role'
+NOT = 'not'
+AND = 'and'
+OR = 'or'
+
+
+class QueryError(ValueError):
+    pass
+
+
+def tokenize(text):
+    """List of operator characters and role names."""
+    tokens = []
+    words = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match is None or match.end() == pos:
+            raise QueryError(f"Cannot read query at: {text[pos:]}")
+        pos = match.end()
+        if match.group('word') is not None:
+            words.append(match.group('word'))
+            continue
+        if words:
+            tokens.append((ROLE, " ".join(words)))
+            words = []
+        if match.group('op') is not None:
+            # - only negates at the start of a term, inside words it is part of the name
+            tokens.append((match.group('op'), None))
+        else:
+            tokens.append((ROLE, match.group('dquoted') or match.group('squoted') or ""))
+    if words:
+        tokens.append((ROLE, " ".join(words)))
+    return tokens
+
+
+class Parser:
+    """Recursive descent parser into nested (op, ...) tuples."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos][0]
+        return None
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError("Empty query.")
+        node = self.disjunction()
+        if self.peek() is not None:
+            raise QueryError(f"Unexpected {self.peek()!r}.")
+        return node
+
+    def disjunction(self):
+        terms = [self.conjunction()]
+        while self.peek() == '|':
+            self.next()
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else (OR, *terms)
+
+    def conjunction(self):
+        terms = [self.negation()]
+        while self.peek() == '&':
+            self.next()
+            terms.append(self.negation())
+        return terms[0] if len(terms) == 1 else (AND, *terms)
+
+    def negation(self):
+        if self.peek() in ('!', '-'):
+            self.next()
+            return (NOT, self.negation())
+        return self.atom()
+
+    def atom(self):
+        kind = self.peek()
+        if kind == '(':
+            self.next()
+            node = self.disjunction()
+            if self.peek() != ')':
+                raise QueryError("Missing ).")
+            self.next()
+            return node
+        if kind == ROLE:
+            name = self.next()[1].strip()
+            if not name:
+                raise QueryError("Empty role name.")
+            return (ROLE, name.lower())
+        if kind is None:
+            raise QueryError("Query ends too early.")
+        raise QueryError(f"Unexpected {kind!r}.")
+
+
+def render(node, parent=None):
+    """Query text of a node, with only the parentheses it needs."""
+    op = node[0]
+    if op == ROLE:
+        name = node[1]
+        if re.search(r'[&|!()"\']', name) or name.startswith('-'):
+            return f"'{name}'" if '"' in name else f'"{name}"'
+        return name
+    if op == NOT:
+        return "!" + render(node[1], NOT)
+    text = (" & " if op == AND else " | ").join(render(child, op) for child in node[1:])
+    if parent in (NOT, AND) and op == OR or parent == NOT and op == AND:
+        return f"({text})"
+    return text
+
+
+class Plan:
+    """Compiled query: postfix instructions over role name bitsets."""
+
+    def __init__(self, node):
+        self.node = node
+        self.instructions = []
+        self.compile(node)
+        self.names = sorted(set(arg for op, arg in self.instructions if op == ROLE))
+
+    def compile(self, node):
+        op = node[0]
+        if op == ROLE:
+            self.instructions.append((ROLE, node[1]))
+        elif op == NOT:
+            self.compile(node[1])
+            self.instructions.append((NOT, None))
+        else:
+            for child in node[1:]:
+                self.compile(child)
+            self.instructions.append((op, len(node) - 1))
+
+    def missing(self, index):
+        """Role names of the plan which do not exist in the guild."""
+        return [name for name in self.names if not index.role_ids(name)]
+
+    def evaluate(self, index):
+        """Bitset of the members of index matching the query."""
+        stack = []
+        for op, arg in self.instructions:
+            if op == ROLE:
+                stack.append(index.named_bitset(arg))
+            elif op == NOT:
+                stack.append(index.universe() & ~stack.pop())
+            else:
+                operands = stack[-arg:]
+                del stack[-arg:]
+                value = operands[0]
+                if op == AND:
+                    for operand in operands[1:]:
+                        value &= operand
+                else:
+                    for operand in operands[1:]:
+                        value |= operand
+                stack.append(value)
+        return stack.pop()
+
+    def __str__(self):
+        return render(self.node)
+
+
+@lru_cache(maxsize=256)
+def compile_query(text) -> Plan:
+    """Plan of query text. Raise QueryError if the query is invalid."""
+    return Plan(Parser(tokenize(text)).parse())
+
+
+def combine(*plans) -> Plan:
+    """Plan matching all of plans."""
+    plans = [plan for plan in plans if plan is not None]
+    if len(plans) == 1:
+        return plans[0]
+    return Plan((AND, *(plan.node for plan in plans)))
+
+
+def names_plan(include=(), exclude=()) -> Plan:
+    """Plan of members with all roles of include and none of exclude, None if both are empty."""
+    terms = [(ROLE, name.lower()) for name in include]
+    terms += [(NOT, (ROLE, name.lower())) for name in exclude]
+    if not terms:
+        return None
+    return Plan(terms[0] if len(terms) == 1 else (AND, *terms))
@@ -0,0 +1,139 @@
+from collections import defaultdict
+
+import discord
+
+
+class GuildRoles:
+    """Member ids by role id and role ids by lowercase name for one guild.
+
+    For queries, every member also gets a bit position, and the members of a
+    role are kept as an integer bitset built on demand and dropped when the
+    role changes.
+    """
+
+    def __init__(self, guild: discord.Guild):
+        self.guild_id = guild.id
+        self.members = defaultdict(set)
+        self.names = defaultdict(set)
+        self.slots = dict()
+        self.slot_members = []
+        self.bitsets = dict()
+        for role in guild.roles:
+            self.add_role(role)
+        for member in guild.members:
+            self.add_member(member)
+
+    def add_role(self, role: discord.Role):
+        self.members[role.id]
+        self.names[role.name.lower()].add(role.id)
+
+    def remove_role(self, role: discord.Role):
+        self.members.pop(role.id, None)
+        self.bitsets.pop(role.id, None)
+        self.discard_name(role.name, role.id)
+
+    def rename_role(self, before: discord.Role, after: discord.Role):
+        self.discard_name(before.name, before.id)
+        self.names[after.name.lower()].add(after.id)
+
+    def discard_name(self, name, role_id):
+        role_ids = self.names.get(name.lower())
+        if role_ids is not None:
+            role_ids.discard(role_id)
+            if not role_ids:
+                del self.names[name.lower()]
+
+    def add_member(self, member: discord.Member, roles=None):
+        if member.id not in self.slots:
+            self.slots[member.id] = len(self.slot_members)
+            self.slot_members.append(member.id)
+        for role in member.roles if roles is None else roles:
+            self.members[role.id].add(member.id)
+            self.bitsets.pop(role.id, None)
+
+    def remove_member(self, member: discord.Member, roles=None):
+        for role in member.roles if roles is None else roles:
+            member_ids = self.members.get(role.id)
+            if member_ids is not None:
+                member_ids.discard(member.id)
+                self.bitsets.pop(role.id, None)
+
+    def update_member(self, before: discord.Member, after: discord.Member):
+        before_roles = set(before.roles)
+        after_roles = set(after.roles)
+        self.remove_member(before, before_roles - after_roles)
+        self.add_member(after, after_roles - before_roles)
+
+    def role_ids(self, name):
+        """Ids of roles named name, case insensitive."""
+        return self.names.get(name.lower(), set())
+
+    def role_members(self, role_id):
+        """Ids of members with role."""
+        return self.members.get(role_id, set())
+
+    def named_members(self, name):
+        """Ids of members with any role named name, case insensitive."""
+        role_ids = self.role_ids(name)
+        if len(role_ids) == 1:
+            return self.role_members(next(iter(role_ids)))
+        return set().union(*(self.role_members(role_id) for role_id in role_ids))
+
+    def bitset(self, role_id):
+        """Bitset of the members with role."""
+        bitset = self.bitsets.get(role_id)
+        if bitset is None:
+            bits = bytearray((len(self.slot_members) + 7) // 8)
+            for member_id in self.role_members(role_id):
+                slot = self.slots[member_id]
+                bits[slot >> 3] |= 1 << (slot & 7)
+            bitset = self.bitsets[role_id] = int.from_bytes(bits, 'little')
+        return bitset
+
+    def named_bitset(self, name):
+        """Bitset of the members with any role named name."""
+        bitset = 0
+        for role_id in self.role_ids(name):
+            bitset |= self.bitset(role_id)
+        return bitset
+
+    def universe(self):
+        """Bitset of every member, the members of @everyone."""
+        return self.bitset(self.guild_id)
+
+    def bitset_members(self, bitset):
+        """Member ids of the bits set in bitset."""
+        bits = bin(bitset)[:1:-1]
+        member_ids = []
+        slot = bits.find('1')
+        while slot != -1:
+            member_ids.append(self.slot_members[slot])
+            slot = bits.find('1', slot + 1)
+        return member_ids
+
+
+class RoleIndex:
+    """Role → members inverted index of every guild, kept current by member and role events.
+
+    Guilds are indexed the first time they are asked for, so the index is
+    complete whether the cog was loaded before or after the bot was ready.
+    """
+
+    def __init__(self):
+        self.guilds = dict()
+
+    def get(self, guild: discord.Guild) -> GuildRoles:
+        index = self.guilds.get(guild.id)
+        if index is None:
+            index = self.guilds[guild.id] = GuildRoles(guild)
+        return index
+
+    def build(self, guilds):
+        self.guilds = {guild.id: GuildRoles(guild) for guild in guilds}
+
+    def remove_guild(self, guild: discord.Guild):
+        self.guilds.pop(guild.id, None)
+
+    def indexed(self, guild: discord.Guild):
+        """Index of guild if it has been built, so events do not build it just to update it."""
+        return self.guilds.get(guild.id)
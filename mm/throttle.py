@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+# Role edits started per second, and how many can start at once after a pause
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 5
+
+# Role edits in flight at the same time
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+
+
+class TokenBucket:
+    """Paces calls to rate per second on average, allowing bursts of capacity calls."""
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def throttled(items, fn, concurrency=DEFAULT_CONCURRENCY, bucket: TokenBucket = None, exceptions=(Exception,)):
+    """Call fn(item) for every item, at most concurrency at a time and paced by bucket.
+
+    Exceptions of the given types are collected instead of stopping the run.
+    Return (list of (item, result), list of (item, exception)) in completion order.
+    """
+    succeeded = []
+    failed = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def visit(item):
+        async with semaphore:
+            if bucket is not None:
+                await bucket.acquire()
+            try:
+                succeeded.append((item, await fn(item)))
+            except exceptions as e:
+                failed.append((item, e))
+
+    # only keep a window of tasks, not one per item
+    pending = set()
+    for item in items:
+        pending.add(asyncio.ensure_future(visit(item)))
+        if len(pending) >= concurrency * 2:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    if pending:
+        await asyncio.wait(pending)
+    return succeeded, failed